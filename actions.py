@@ -0,0 +1,91 @@
+"""Writes shared by the HTML views and the JSON API.
+
+Each one commits, then tells the caches what changed, so callers only
+decide what to send back. The background tasks at the end do the parts
+of writes that can wait (see jobs.py).
+"""
+
+from extensions import jobs, session_users, timeline_cache
+from models import db, User, Message, Likes, Follows
+
+
+def follow(user_id, follow_id):
+    """Have `user_id` follow `follow_id`; a no-op if they already do."""
+
+    if not Follows.exists(user_id, follow_id):
+        db.session.add(Follows(user_being_followed_id=follow_id, user_following_id=user_id))
+        User.adjust_counts(user_id, following_count=1)
+        User.adjust_counts(follow_id, followers_count=1)
+        db.session.commit()
+        session_users.invalidate(user_id, follow_id)
+    timeline_cache.invalidate(user_id)
+
+
+def unfollow(user_id, follow_id):
+    """Have `user_id` stop following `follow_id`, if they do."""
+
+    removed = (Follows
+               .query
+               .filter_by(user_being_followed_id=follow_id, user_following_id=user_id)
+               .delete())
+    if removed:
+        User.adjust_counts(user_id, following_count=-1)
+        User.adjust_counts(follow_id, followers_count=-1)
+        db.session.commit()
+        session_users.invalidate(user_id, follow_id)
+    timeline_cache.invalidate(user_id)
+
+
+def toggle_like(user_id, message_id):
+    """Like the message if `user_id` hasn't yet, else unlike it.
+
+    Returns whether the message is liked afterwards.
+    """
+
+    liked, change = Likes.toggle(user_id, message_id)
+    record_like_change(user_id, message_id, change)
+    return liked
+
+
+def set_like(user_id, message_id, liked):
+    """Make `user_id` like the message, or not; safe to repeat."""
+
+    if liked:
+        change = Likes.like(user_id, message_id)
+    else:
+        change = -Likes.unlike(user_id, message_id)
+    record_like_change(user_id, message_id, change)
+
+
+def record_like_change(user_id, message_id, change):
+    """Apply a like (+1) or unlike (-1) to both counters and commit."""
+
+    if change:
+        User.adjust_counts(user_id, likes_count=change)
+        Message.adjust_like_count(message_id, change)
+    db.session.commit()
+    if change:
+        session_users.invalidate(user_id)
+
+
+@jobs.task('fan_out_message')
+def fan_out_message(message_id, author_id):
+    """Push a new message onto its author's followers' shared cached timelines."""
+
+    timeline_cache.fan_out(message_id, author_id)
+
+
+@jobs.task('remove_message')
+def remove_message(message_id, author_id):
+    """Take a deleted message off its author's followers' shared cached timelines."""
+
+    timeline_cache.remove_message(message_id, author_id)
+
+
+@jobs.task('recount_users')
+def recount_users(user_ids):
+    """Rebuild the counters of `user_ids`, e.g. everyone who liked a deleted message."""
+
+    User.recount(user_ids)
+    db.session.commit()
+    session_users.invalidate(*user_ids)
@@ -0,0 +1,121 @@
+"""Versioned JSON API, for clients that don't want whole pages.
+
+Everything is under /api/v1 and uses the same login session as the site.
+Lists of messages come a page at a time with the same `before` cursors
+as the HTML pages; `next_cursor` is null on the last page. Errors are
+JSON too: {"error": "..."} with the matching status code.
+
+Requests that change anything must send `X-Requested-With:
+XMLHttpRequest`. Browsers won't add that header to a cross-site request
+without asking the server first, so other sites can't use a visitor's
+session to like or follow on their behalf.
+"""
+
+from functools import wraps
+
+from flask import Blueprint, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+import actions
+from extensions import timeline_cache
+from models import User, Message
+from pagination import paginate
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def error(status, message):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(HTTPException)
+def http_error(exc):
+    return error(exc.code, exc.description)
+
+
+@api.before_request
+def check_requested_with():
+    if (request.method not in ('GET', 'HEAD', 'OPTIONS')
+            and request.headers.get('X-Requested-With') != 'XMLHttpRequest'):
+        return error(403, "Send X-Requested-With: XMLHttpRequest with this request.")
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not g.user:
+            return error(401, "Log in first.")
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def message_page(page):
+    """JSON for a `Page` of messages fetched with the viewer's `liked_ids`."""
+
+    return jsonify(messages=[msg.serialize(liked=msg.id in page.liked_ids) for msg in page.items],
+                   next_cursor=page.next_cursor)
+
+
+@api.route('/timeline')
+@login_required
+def timeline():
+    """The logged-in user's home timeline."""
+
+    return message_page(timeline_cache.timeline(g.user, request.args.get('before')))
+
+
+@api.route('/users/<int:user_id>')
+@login_required
+def user_detail(user_id):
+    """A user's profile, and whether the logged-in user follows them."""
+
+    user = User.active_or_404(user_id)
+    return jsonify(user=user.serialize(), following=g.user.is_following(user))
+
+
+@api.route('/users/<int:user_id>/messages')
+@login_required
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    User.active_or_404(user_id)
+    query = Message.with_authors().filter(Message.user_id == user_id)
+    return message_page(paginate(query, request.args.get('before'), liked_by=g.user.id))
+
+
+@api.route('/users/<int:user_id>/follow', methods=['POST', 'DELETE'])
+@login_required
+def follow(user_id):
+    """Follow (POST) or stop following (DELETE) a user."""
+
+    User.active_or_404(user_id)
+
+    if request.method == 'POST':
+        actions.follow(g.user.id, user_id)
+    else:
+        actions.unfollow(g.user.id, user_id)
+
+    user = User.query.get(user_id)
+    return jsonify(user_id=user_id, following=request.method == 'POST',
+                   followers_count=user.followers_count)
+
+
+@api.route('/messages/<int:message_id>/like', methods=['POST', 'PUT', 'DELETE'])
+@login_required
+def like(message_id):
+    """Toggle the like on a message (POST), or set it: like (PUT) or unlike (DELETE).
+
+    PUT and DELETE are idempotent, so clients can safely retry them.
+    """
+
+    msg = Message.query.get_or_404(message_id)
+
+    if request.method == 'POST':
+        liked = actions.toggle_like(g.user.id, message_id)
+    else:
+        liked = request.method == 'PUT'
+        actions.set_like(g.user.id, message_id, liked)
+
+    return jsonify(message_id=message_id, liked=liked, like_count=msg.like_count)
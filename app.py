@@ -1,42 +1,76 @@
 import os
 
-from flask import Flask, render_template,request, flash, redirect, session,abort,g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Flask, render_template,request, flash, redirect, session,abort,g,make_response
 from sqlalchemy.exc import IntegrityError
-from flask_bcrypt import Bcrypt
 
+import actions
+from api import api
+from config import CONFIGS
+from extensions import (fragment_cache, http_cache, jobs, login_limiter, query_metrics,
+                        timeline_cache, session_users)
 from forms import UserAddForm, LoginForm, MessageForm,UserEditForm
-from models import db, connect_db, User, Message,Likes
+from http_cache import newest, page_validators, not_modified, add_validators
+from models import db, connect_db, User, Message, Likes, Follows
+from pagination import paginate, paginate_follows
+from parallel import gather
+from passwords import passwords
+from purge import tombstone
+from search import search_users, search_messages, index_message, unindex_message
 
 CURR_USER_KEY = "curr_user"
-bcrypt = Bcrypt()
-app = Flask(__name__)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+class Views:
+    """Routes, hooks and commands, registered on each app by create_app().
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+    Unlike a Blueprint this keeps the bare endpoint names, so
+    url_for('login') and friends work unchanged.
+    """
+
+    def __init__(self):
+        self.deferred = []
+
+    def route(self, rule, **options):
+        def decorator(f):
+            self.deferred.append(lambda app: app.add_url_rule(rule, f.__name__, f, **options))
+            return f
+        return decorator
+
+    def before_request(self, f):
+        self.deferred.append(lambda app: app.before_request(f))
+        return f
+
+    def after_request(self, f):
+        self.deferred.append(lambda app: app.after_request(f))
+        return f
 
-connect_db(app)
+    def cli_command(self, name):
+        def decorator(f):
+            self.deferred.append(lambda app: app.cli.command(name)(f))
+            return f
+        return decorator
+
+    def register(self, app):
+        for register in self.deferred:
+            register(app)
+
+
+views = Views()
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@views.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        id = session[CURR_USER_KEY]
-        g.user = User.query.get(id)
+    This is a cached snapshot of the user (see session_user.py), not a
+    `User` row, and isn't looked up at all for static files.
+    """
+
+    if CURR_USER_KEY in session and request.endpoint != 'static':
+        g.user = session_users.load(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -57,7 +91,7 @@ def do_logout():
     return redirect("/login")
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@views.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -80,6 +114,7 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
             db.session.commit()
+            login_limiter.forget_unknown(user.username)
 
         except IntegrityError:
             flash("Username already taken", 'danger')
@@ -93,27 +128,41 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        username = form.username.data
+        # Throttled and known-bad attempts never reach the DB or bcrypt.
+        login_limiter.check(username)
+
+        checked = not login_limiter.is_unknown(username)
+        if checked:
+            user = User.authenticate(username,
+                                     form.password.data)
+        else:
+            user = None
 
         if user:
+            # Saves a rehashed password, if authenticate() made one.
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
 
+        # Only a lookup that ran can tell there's no such user; a refusal
+        # from the cache mustn't keep its own entry alive.
+        login_limiter.failed(username, unknown=checked and user is None)
         flash("Invalid credentials.", 'danger')
+        return redirect('/login')
 
-    return redirect('/login')
+    return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     """Handle logout of user."""
     user_id = session[CURR_USER_KEY]
@@ -127,52 +176,94 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@views.route('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations, and a 'page' param for further pages of results.
     """
 
-    search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    search = request.args.get('q', '')
+    results = search_users(search, request.args.get('page', 1, type=int))
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=results.items, q=search,
+                           page=results.page, has_next=results.has_next)
 
 
 
-@app.route('/users/<int:user_id>')
+@views.route('/users/<int:user_id>')
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
 
+    Takes an optional 'before' cursor in the querystring for older messages.
+    """
 
     if CURR_USER_KEY in session:
-        user_id = session[CURR_USER_KEY]
-        user = User.query.get_or_404(user_id)
-   
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-        messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    
-        message_ids = [m.id for m in messages]
-        
-        likes = Likes.query.filter(Likes.user_id == g.user.id, Likes.message_id.in_(message_ids)).all()
-    
-        return render_template('users/show.html', user=user, messages=messages,likes=likes)
+        before = request.args.get('before')
+        viewer_id = g.user.id
+        # The profile and its messages (with the viewer's likes joined in)
+        # are independent, so they're fetched together.
+        user, page = gather(
+            lambda: User.active_or_404(user_id),
+            lambda: paginate(Message.query.filter(Message.user_id == user_id), before,
+                             liked_by=viewer_id))
+
+        # Posting or deleting bumps the user's version; liking or following
+        # bumps the viewer's. Other people's likes only change like counts,
+        # which don't touch a timestamp, so there's no Last-Modified.
+        validators = page_validators('users_show', user.id, user.profile_version,
+                                     g.user.id, g.user.profile_version, before,
+                                     [(m.id, m.like_count) for m in page.items])
+        cached = not_modified(validators)
+        if cached:
+            return cached
+
+        html = render_template('users/show.html', user=user, messages=page.items,
+                               liked_ids=page.liked_ids, next_cursor=page.next_cursor)
+        return add_validators(make_response(html), validators)
     return redirect("/login")
 
 
 
-@app.route('/users/<int:user_id>/following')
+def follows_page_validators(endpoint, user, page):
+    """Validators for a page of `user`'s followed users or followers.
+
+    Follows and unfollows bump `user`'s version, and the viewer's for the
+    buttons; a listed user's edits bump theirs.
+    """
+
+    return page_validators(endpoint, user.id, user.profile_version,
+                           g.user.id, g.user.profile_version,
+                           [(u.id, u.profile_version) for u in page.items],
+                           request.args.get('after'),
+                           last_modified=newest(user.updated_at, g.user.updated_at,
+                                                *(u.updated_at for u in page.items)))
+
+
+def render_follows_page(endpoint, template, user_id, followers):
+    """Render one page of a user's followed users or followers.
+
+    Takes an optional 'after' cursor in the querystring for the next page.
+    Follow buttons for the page are looked up in one query.
+    """
+
+    user = User.active_or_404(user_id)
+    page = paginate_follows(user.id, followers=followers,
+                            after=request.args.get('after', type=int))
+
+    validators = follows_page_validators(endpoint, user, page)
+    cached = not_modified(validators)
+    if cached:
+        return cached
+
+    following_ids = Follows.followed_among(g.user.id, [u.id for u in page.items])
+    html = render_template(template, user=user, users=page.items,
+                           following_ids=following_ids, next_cursor=page.next_cursor)
+    return add_validators(make_response(html), validators)
+
+
+@views.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -180,12 +271,12 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    return render_follows_page('show_following', 'users/following.html', user_id,
+                               followers=False)
 
 
 
-@app.route('/users/<int:user_id>/followers')
+@views.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -193,12 +284,12 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    return render_follows_page('users_followers', 'users/followers.html', user_id,
+                               followers=True)
 
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@views.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -206,15 +297,14 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    User.active_or_404(follow_id)
+    actions.follow(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@views.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -222,15 +312,13 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    actions.unfollow(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@views.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     
@@ -243,7 +331,7 @@ def profile():
 
         if form.validate_on_submit():
             password = form.password.data
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check(user.password, password)
             if is_auth:
                 user.username = form.username.data 
                 user.email = form.email.data
@@ -253,6 +341,8 @@ def profile():
 
                 db.session.add(user)
                 db.session.commit()
+                session_users.invalidate(user.id)
+                login_limiter.forget_unknown(user.username)
                 return redirect(f'/users/{user.id}')
         
         return render_template("/users/edit.html", form=form, user=user)
@@ -262,23 +352,22 @@ def profile():
   
   
   
-@app.route('/users/likes', methods=["GET"])
+@views.route('/users/likes', methods=["GET"])
 def show_all_likes():
-    """Show all the messages with likes"""
-    likedMessage_ids =[]
-    messages = []
+    """Show the messages the current user has liked, newest first.
+
+    Takes an optional 'before' cursor in the querystring for older messages.
+    """
     
     if g.user:
-       allLikes = Likes.query.filter(Likes.user_id == g.user.id).all()
-       likedMessage_ids.extend(l.message_id for l in allLikes)     
+       liked = (Message
+                .with_authors()
+                .join(Likes, Likes.message_id == Message.id)
+                .filter(Likes.user_id == g.user.id))
+       page = paginate(liked, request.args.get('before'))
        
-       for like_id in likedMessage_ids:
-            message = Message.query.filter_by(id=like_id).first()
-            if message:
-                messages.append(message)
-            
-       
-       return render_template("/users/show-liked-message.html",messages=messages)
+       return render_template("/users/show-liked-message.html",
+                              messages=page.items, next_cursor=page.next_cursor)
    
     return redirect("/login")
         
@@ -286,7 +375,7 @@ def show_all_likes():
     
     
 
-@app.route('/users/<int:user_id>/delete', methods=["POST"])
+@views.route('/users/<int:user_id>/delete', methods=["POST"])
 def delete_user(user_id):
     """Delete user."""
 
@@ -296,8 +385,11 @@ def delete_user(user_id):
 
     do_logout()
 
-    db.session.delete(g.user)
+    # Only a tombstone here; a background job deletes the rows in batches.
+    tombstone(user_id)
     db.session.commit()
+    session_users.invalidate(user_id)
+    jobs.notify()
 
     return redirect("/signup")
 
@@ -305,7 +397,7 @@ def delete_user(user_id):
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@views.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -319,9 +411,22 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        User.adjust_counts(g.user.id, messages_count=1)
+        db.session.flush()
+        if timeline_cache.queued:
+            # Followers' timelines can wait for a background job.
+            jobs.enqueue('fan_out_message', msg.id, g.user.id,
+                         key=f'fan_out_message:{msg.id}')
         db.session.commit()
+        session_users.invalidate(g.user.id)
+        if timeline_cache.queued:
+            timeline_cache.add_message(msg)
+        else:
+            timeline_cache.fan_out(msg.id, g.user.id)
+        index_message(msg)
+        jobs.notify()
 
         return redirect(f"/users/{g.user.id}")
 
@@ -329,17 +434,51 @@ def messages_add():
 
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@views.route('/messages/search')
+def messages_search():
+    """Search messages.
+
+    Takes a 'q' param in querystring to search for and a 'page' param for
+    further pages of results.
+    """
+
+    if not g.user:
+        return redirect("/login")
+
+    search = request.args.get('q', '')
+    results = search_messages(search, request.args.get('page', 1, type=int))
+
+    return render_template('messages/search.html', messages=results.items, q=search,
+                           page=results.page, has_next=results.has_next)
+
+
+@views.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
     if CURR_USER_KEY in session:
-        msg = Message.query.get(message_id)
-        return render_template('messages/show.html', message=msg)
+        msg = Message.query.get_or_404(message_id)
+        author = msg.user
+        if author.deleted_at is not None:
+            abort(404)
+
+        # Messages never change; the author's card and the viewer's follow
+        # button can.
+        validators = page_validators('messages_show', msg.id,
+                                     author.id, author.profile_version,
+                                     g.user.id, g.user.profile_version,
+                                     last_modified=newest(msg.timestamp, author.updated_at,
+                                                          g.user.updated_at))
+        cached = not_modified(validators)
+        if cached:
+            return cached
+
+        html = render_template('messages/show.html', message=msg)
+        return add_validators(make_response(html), validators)
 
     return redirect("/login")
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@views.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -349,71 +488,104 @@ def messages_destroy(message_id):
     if session[CURR_USER_KEY] != message.user_id:
         abort(403)  
         
+    # The likers' counters (and followers' timelines, when the timeline
+    # cache is queued) are fixed up by background jobs, once the message
+    # and its likes are gone.
+    liker_ids = [id for (id,) in db.session.query(Likes.user_id).filter(Likes.message_id == message_id)]
+    if liker_ids:
+        jobs.enqueue('recount_users', liker_ids, key=f'recount_users:message:{message_id}')
+    if timeline_cache.queued:
+        jobs.enqueue('remove_message', message_id, message.user_id,
+                     key=f'remove_message:{message_id}')
+    User.adjust_counts(message.user_id, messages_count=-1)
+
+    Likes.query.filter(Likes.message_id == message_id).delete(synchronize_session=False)
     db.session.delete(message)
     db.session.commit()
+    session_users.invalidate(message.user_id)
+    if timeline_cache.queued:
+        timeline_cache.drop_message(message_id, message.user_id)
+    else:
+        timeline_cache.remove_message(message_id, message.user_id)
+    fragment_cache.forget(message_id)
+    unindex_message(message_id)
+    jobs.notify()
 
     return redirect(f"/users/{message.user_id}")
 
 
 
-@app.route('/users/add_like/<int:msg_id>', methods=["POST"])
+@views.route('/users/add_like/<int:msg_id>', methods=["POST"])
 def handle_like(msg_id):
     
     if CURR_USER_KEY in session:
         user_id = session[CURR_USER_KEY]
-        existing_like = Likes.query.filter(Likes.user_id == user_id).filter(Likes.message_id == msg_id).first()
-        if not existing_like:
-            new_like = Likes(user_id = user_id, message_id = msg_id)
-            db.session.add(new_like)
-        else:
-            db.session.delete(existing_like)
-        db.session.commit()
+        actions.toggle_like(user_id, msg_id)
         return redirect("/")
     return redirect("/login")
+
+
+@views.cli_command('recount')
+def recount():
+    """Rebuild every user's counters and every message's like count."""
+
+    User.recount()
+    Message.recount()
+    db.session.commit()
         
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@views.route('/')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed users and yourself;
+      takes an optional 'before' cursor in the querystring for older ones
     """
-    messages = []
     if g.user:
-        following_users = g.user.following
-        for u in following_users:
-            messages.extend(u.messages)
-            
-        messages=messages[:100]
-        message_ids = [m.id for m in messages]
-        
-        allLikes = Likes.query.filter(Likes.user_id == g.user.id).all()
-        likes = Likes.query.filter(Likes.user_id == g.user.id, Likes.message_id.in_(message_ids)).all()
-            
+        # The viewer's likes come with the timeline (see timeline.py).
+        page = timeline_cache.timeline(g.user, request.args.get('before'))
 
-        return render_template('home.html', messages=messages, likes=likes, allLikes=allLikes)
+        return render_template('home.html', messages=page.items, liked_ids=page.liked_ids,
+                               next_cursor=page.next_cursor)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# App factory
+
+
+def create_app(config_name='dev'):
+    """Build the app with one of the profiles in config.py: dev, test or prod."""
+
+    app = Flask(__name__)
+    app.config.from_object(CONFIGS[config_name])
+
+    if app.config['DEBUG_TOOLBAR']:
+        # Imported here so test and production workers never load it.
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    passwords.init_app(app)
+    fragment_cache.init_app(app)
+    http_cache.init_app(app)
+    jobs.init_app(app)
+    login_limiter.init_app(app)
+    query_metrics.init_app(app)
+    timeline_cache.init_app(app)
+    session_users.init_app(app)
+    views.register(app)
+    app.register_blueprint(api)
+
+    return app
+
+
+# For `flask run`, `gunicorn app:app` and the tests; set WARBLER_ENV=prod
+# in production.
+app = create_app(os.environ.get('WARBLER_ENV', 'dev'))
@@ -0,0 +1,43 @@
+"""Per-app state for Warbler's Flask extensions.
+
+The extensions in extensions.py are module-level objects shared by every
+app create_app() builds, so they keep nothing app-specific themselves:
+`init_app()` puts each app's settings, caches and pools in
+`app.extensions`, and methods look them up for the current app.
+"""
+
+from flask import current_app, has_app_context
+
+
+class AppExtension:
+    """Base for extensions keeping their per-app state in `app.extensions[name]`.
+
+    Outside an app context (scripts, test set-up), the first app it was
+    initialized on is used, much as Flask-SQLAlchemy falls back to `db.app`.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.app = None
+
+    def bind(self, app, state):
+        """Store `state` as this extension's state for `app`."""
+
+        app.extensions[self.name] = state
+        if self.app is None:
+            self.app = app
+
+    def get_app(self):
+        """The current app, or else the first one initialized."""
+
+        if has_app_context():
+            return current_app._get_current_object()
+        if self.app is None:
+            raise RuntimeError(f"{type(self).__name__} isn't initialized on any app")
+        return self.app
+
+    def state(self):
+        """This extension's state for the current app."""
+
+        return self.get_app().extensions[self.name]
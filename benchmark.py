@@ -0,0 +1,352 @@
+"""Benchmark Warbler's hot paths through the Flask test client.
+
+Drives a seeded, random mix of the main user flows (home timeline,
+profiles, follow/unfollow, likes, searches, posting and logging in)
+against whatever database DATABASE_URL points at, and reports latency
+percentiles and SQL query counts per flow as JSON. Run it against a
+throwaway database: the write flows really write.
+
+    python generator/generate.py --users 100000 --messages 1000000 --follows 2000000
+    python seed.py
+    python benchmark.py --requests 2000 --out bench.json
+
+Compare the JSON from two commits to catch regressions before deploying.
+
+With --url it instead loads a running server with --concurrency clients
+at once, using only the read flows, and reports throughput as well.
+Run it once per serving profile (see gunicorn.conf.py) and compare:
+
+    WARBLER_ENV=prod WARBLER_SERVER=sync gunicorn app:app &
+    python benchmark.py --url http://localhost:8000 --concurrency 32 --out sync.json
+    # restart with WARBLER_SERVER=gevent
+    python benchmark.py --url http://localhost:8000 --concurrency 32 --out gevent.json
+    python benchmark.py --compare sync.json gevent.json
+
+The server must share this app's SECRET_KEY, as session cookies are made
+here rather than by logging in.
+"""
+
+import argparse
+import json
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from random import Random
+from threading import Lock
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from sqlalchemy import event
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message
+
+# Every generated user has this password (see generator/generate.py).
+PASSWORD = 'password'
+
+# Relative frequency of each flow in the mix.
+FLOWS = {
+    'home': 40,
+    'profile': 20,
+    'like': 10,
+    'follow': 10,
+    'search': 10,
+    'post': 5,
+    'login': 5,
+}
+
+
+# The flows --url runs; they only read, so any number can run at once.
+READ_FLOWS = {
+    'home': 50,
+    'profile': 30,
+    'message': 20,
+}
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements run inside the block: `with count_queries() as n`."""
+
+    counter = [0]
+
+    def before_cursor_execute(*args):
+        counter[0] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values`."""
+
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Benchmark:
+    """One benchmark run: a test client, a random source and the timings."""
+
+    def __init__(self, seed, sample_size):
+        self.rng = Random(seed)
+        self.client = app.test_client()
+        self.timings = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+        with app.app_context():
+            self.users = db.session.query(User.id, User.username).limit(sample_size).all()
+            self.message_ids = [id for (id,) in db.session.query(Message.id).limit(sample_size)]
+
+        if not self.users or not self.message_ids:
+            sys.exit("No data to benchmark against; seed the database first.")
+
+    def log_in_as(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def request(self, name, method, url, **kwargs):
+        """Make a request, recording its latency and query count under `name`."""
+
+        with count_queries() as queries:
+            start = perf_counter()
+            response = self.client.open(url, method=method, **kwargs)
+            elapsed = perf_counter() - start
+
+        self.timings[name].append(elapsed * 1000)
+        self.queries[name].append(queries[0])
+        # Anything but a page or a redirect, e.g. a 404 or a 429, is an error.
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    def run_flow(self, flow):
+        user_id, username = self.rng.choice(self.users)
+        other_id, other_username = self.rng.choice(self.users)
+        message_id = self.rng.choice(self.message_ids)
+
+        if flow == 'login':
+            self.request('login', 'POST', '/login',
+                         data={'username': username, 'password': PASSWORD})
+            return
+
+        self.log_in_as(user_id)
+
+        if flow == 'home':
+            self.request('home', 'GET', '/')
+        elif flow == 'profile':
+            self.request('profile', 'GET', f'/users/{other_id}')
+        elif flow == 'like':
+            self.request('like', 'POST', f'/users/add_like/{message_id}')
+        elif flow == 'follow':
+            self.request('follow', 'POST', f'/users/follow/{other_id}')
+            self.request('unfollow', 'POST', f'/users/stop-following/{other_id}')
+        elif flow == 'search':
+            self.request('search_users', 'GET', '/users', query_string={'q': other_username[:4]})
+            self.request('search_messages', 'GET', '/messages/search',
+                         query_string={'q': self.rng.choice(['bird', 'world', 'river', 'song'])})
+        elif flow == 'post':
+            self.request('post', 'POST', '/messages/new', data={'text': 'Benchmark warble'})
+
+    def run(self, requests, warmup):
+        names = list(FLOWS)
+        weights = [FLOWS[name] for name in names]
+
+        for _ in range(warmup):
+            self.run_flow(self.rng.choices(names, weights)[0])
+        self.timings.clear()
+        self.queries.clear()
+        self.errors.clear()
+
+        for _ in range(requests):
+            self.run_flow(self.rng.choices(names, weights)[0])
+
+    def report(self):
+        endpoints = {}
+        for name, timings in sorted(self.timings.items()):
+            queries = self.queries[name]
+            endpoints[name] = {
+                'requests': len(timings),
+                'errors': self.errors[name],
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'mean_ms': round(sum(timings) / len(timings), 2),
+                'max_ms': round(max(timings), 2),
+                'queries_mean': round(sum(queries) / len(queries), 2),
+                'queries_max': max(queries),
+            }
+        return endpoints
+
+
+class HTTPBenchmark:
+    """Concurrent read load against a running server."""
+
+    def __init__(self, url, seed, sample_size, concurrency):
+        self.url = url.rstrip('/')
+        self.seed = seed
+        self.concurrency = concurrency
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = Lock()
+        self.elapsed = 0
+
+        with app.app_context():
+            self.user_ids = [id for (id,) in db.session.query(User.id).limit(sample_size)]
+            self.message_ids = [id for (id,) in db.session.query(Message.id).limit(sample_size)]
+
+        if not self.user_ids or not self.message_ids:
+            sys.exit("No data to benchmark against; seed the database first.")
+
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie_name = app.config['SESSION_COOKIE_NAME']
+
+    def session_cookie(self, user_id):
+        return f"{self.cookie_name}={self.serializer.dumps({CURR_USER_KEY: user_id})}"
+
+    def request(self, name, path, user_id):
+        request = Request(self.url + path, headers={'Cookie': self.session_cookie(user_id)})
+
+        start = perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+            failed = False
+        except HTTPError:
+            # urlopen follows redirects, so this is a 4xx or 5xx.
+            failed = True
+        elapsed = perf_counter() - start
+
+        with self.lock:
+            self.timings[name].append(elapsed * 1000)
+            if failed:
+                self.errors[name] += 1
+
+    def run_client(self, client, requests):
+        rng = Random(self.seed * 1000 + client)
+        names = list(READ_FLOWS)
+        weights = [READ_FLOWS[name] for name in names]
+
+        for _ in range(requests):
+            flow = rng.choices(names, weights)[0]
+            user_id = rng.choice(self.user_ids)
+
+            if flow == 'home':
+                self.request('home', '/', user_id)
+            elif flow == 'profile':
+                self.request('profile', f'/users/{rng.choice(self.user_ids)}', user_id)
+            elif flow == 'message':
+                self.request('message', f'/messages/{rng.choice(self.message_ids)}', user_id)
+
+    def run_clients(self, requests):
+        per_client = max(1, requests // self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for future in [pool.submit(self.run_client, client, per_client)
+                           for client in range(self.concurrency)]:
+                future.result()
+
+    def run(self, requests, warmup):
+        self.run_clients(warmup)
+        self.timings.clear()
+        self.errors.clear()
+
+        start = perf_counter()
+        self.run_clients(requests)
+        self.elapsed = perf_counter() - start
+
+    def report(self):
+        endpoints = {}
+        for name, timings in sorted(self.timings.items()):
+            endpoints[name] = {
+                'requests': len(timings),
+                'errors': self.errors[name],
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'mean_ms': round(sum(timings) / len(timings), 2),
+                'max_ms': round(max(timings), 2),
+            }
+        total = sum(len(timings) for timings in self.timings.values())
+        return endpoints, round(total / self.elapsed, 1)
+
+
+def compare(base_path, new_path):
+    """Print how the report at `new_path` does against the one at `base_path`."""
+
+    with open(base_path) as base_file, open(new_path) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+
+    if 'throughput_rps' in base and 'throughput_rps' in new:
+        print(f"throughput: {base['throughput_rps']} -> {new['throughput_rps']} req/s "
+              f"(x{new['throughput_rps'] / base['throughput_rps']:.2f})")
+
+    print(f"{'endpoint':<16} {'p50 ms':>20} {'p99 ms':>20}")
+    for name, stats in sorted(new['endpoints'].items()):
+        before = base['endpoints'].get(name)
+        if before is None:
+            continue
+        p50 = f"{before['p50_ms']} -> {stats['p50_ms']}"
+        p99 = f"{before['p99_ms']} -> {stats['p99_ms']}"
+        print(f"{name:<16} {p50:>20} {p99:>20}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=500, help="flows to run (after warmup)")
+    parser.add_argument('--warmup', type=int, default=50, help="flows to run before measuring")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample-size', type=int, default=10000,
+                        help="how many users/messages to pick targets from")
+    parser.add_argument('--out', help="write the JSON report here instead of stdout")
+    parser.add_argument('--url', help="load this running server instead of the test client")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="clients at once, with --url")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help="compare two JSON reports instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    # Every login comes from the test client's one IP, so the limiter would
+    # turn most of them away.
+    app.config['LOGIN_RATE_LIMIT'] = False
+
+    if args.url:
+        bench = HTTPBenchmark(args.url, args.seed, args.sample_size, args.concurrency)
+        bench.run(args.requests, args.warmup)
+        endpoints, throughput = bench.report()
+        report = {
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'requests': args.requests,
+            'throughput_rps': throughput,
+            'endpoints': endpoints,
+        }
+    else:
+        bench = Benchmark(args.seed, args.sample_size)
+        bench.run(args.requests, args.warmup)
+        report = {
+            'database': db.engine.dialect.name,
+            'seed': args.seed,
+            'requests': args.requests,
+            'endpoints': bench.report(),
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Small in-process caches shared by Warbler's subsystems."""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+    """Thread-safe mapping that forgets its least recently used keys.
+
+    Holds at most `maxsize` entries; setting a new key when full drops
+    whichever entry was read or written longest ago. With `ttl` (seconds),
+    entries also expire that long after they were set.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._expires = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value for `key`, marking it as recently used."""
+
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            if self.ttl is not None and self._expires[key] <= monotonic():
+                del self._data[key], self._expires[key]
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        """Store `value` under `key`, evicting the oldest entry if full."""
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.ttl is not None:
+                self._expires[key] = monotonic() + self.ttl
+            while len(self._data) > self.maxsize:
+                oldest, _ = self._data.popitem(last=False)
+                self._expires.pop(oldest, None)
+
+    def replace(self, key, value):
+        """Change the value of a live `key`, keeping when it expires.
+
+        Returns False, storing nothing, if `key` isn't there.
+        """
+
+        with self._lock:
+            if key not in self._data:
+                return False
+            if self.ttl is not None and self._expires[key] <= monotonic():
+                del self._data[key], self._expires[key]
+                return False
+            self._data[key] = value
+            self._data.move_to_end(key)
+            return True
+
+    def pop(self, key, default=None):
+        """Remove `key` and return its value (or `default`)."""
+
+        with self._lock:
+            self._expires.pop(key, None)
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
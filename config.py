@@ -0,0 +1,84 @@
+"""Configuration profiles for Warbler; pick one with create_app(name)."""
+
+import os
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    TIMELINE_FANOUT = os.environ.get('TIMELINE_FANOUT') == '1'
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    SLOW_REQUEST_QUERIES = int(os.environ.get('SLOW_REQUEST_QUERIES', 50))
+
+    DEBUG_TOOLBAR = False
+
+    # bcrypt cost for new password hashes, and the pool running it (see
+    # passwords.py). Raising the cost rehashes passwords as people log in.
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+    BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', 16))
+
+    # Run pages' independent queries concurrently (see parallel.py).
+    PARALLEL_QUERIES = os.environ.get('PARALLEL_QUERIES') == '1'
+    PARALLEL_QUERY_THREADS = int(os.environ.get('PARALLEL_QUERY_THREADS', 4))
+
+    # Rows deleted per transaction when purging a deleted account.
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+
+
+class DevConfig(Config):
+    """Local development: the debug toolbar is on."""
+
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class TestConfig(Config):
+    """Running the test suite."""
+
+    WTF_CSRF_ENABLED = False
+    # Tests recreate users with the same ids; never serve a cached one.
+    SESSION_USER_TTL = 0
+    # Cheap hashes, made in the test's own thread.
+    BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_INLINE = True
+    # Run background jobs before the request returns.
+    JOBS_INLINE = True
+
+
+class ProdConfig(Config):
+    """Serving real traffic under gunicorn.
+
+    Each worker process gets its own connection pool, so the database
+    must allow workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+    """
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # Recycle before server/proxy idle timeouts cut connections, and
+        # check connections on checkout so a restarted database doesn't
+        # fail the first request on every stale one.
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+    # /metrics is public once mounted; turn it on only where the scraper
+    # reaches workers on a private address (see metrics.py).
+    METRICS_ENDPOINT = os.environ.get('METRICS_ENDPOINT') == '1'
+
+
+CONFIGS = {
+    'dev': DevConfig,
+    'test': TestConfig,
+    'prod': ProdConfig,
+}
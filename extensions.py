@@ -0,0 +1,21 @@
+"""Warbler's Flask extensions, created unbound; create_app() binds them.
+
+They live here rather than in app.py so that blueprints and helpers can
+import them without importing the app.
+"""
+
+from fragments import FragmentCache
+from http_cache import HTTPCache
+from jobs import JobQueue
+from metrics import QueryMetrics
+from ratelimit import LoginLimiter
+from session_user import SessionUserLoader
+from timeline import TimelineCache
+
+fragment_cache = FragmentCache()
+http_cache = HTTPCache()
+jobs = JobQueue()
+login_limiter = LoginLimiter()
+query_metrics = QueryMetrics()
+timeline_cache = TimelineCache()
+session_users = SessionUserLoader()
@@ -0,0 +1,80 @@
+"""Cache of rendered message list items.
+
+The timeline, profile and likes pages show the same `<li>` for a message
+(templates/messages/item.html) to everyone, differing only in whether
+the viewer liked it. Rendering it once per (author version, like count,
+liked) and reusing the HTML turns a page of 100 messages into string
+joins.
+
+An entry is only reused while the author's `profile_version` and the
+message's `like_count` match, so profile edits (and counter changes,
+which bump the version too) and likes invalidate fragments without any
+bookkeeping. Deleted messages are dropped with `forget()`.
+"""
+
+from threading import Lock
+
+from flask import current_app
+from markupsafe import Markup
+
+from appstate import AppExtension
+from cache import LRUCache
+
+ITEM_TEMPLATE = 'messages/item.html'
+
+
+class FragmentCache(AppExtension):
+    """Flask extension caching rendered message items, per message id."""
+
+    name = 'fragment_cache'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+
+        self.bind(app, LRUCache(app.config['FRAGMENT_CACHE_SIZE']))
+        app.add_template_global(self.message_item)
+
+    def message_item(self, msg, liked=False):
+        """The `<li>` for `msg`, from the cache when it's current.
+
+        The item template sees only `msg` and `liked`, never the request,
+        so one rendering is right for every viewer.
+        """
+
+        # The timestamp tells a message apart from an earlier one that had
+        # its id (SQLite reuses ids of deleted rows).
+        version = (msg.timestamp, msg.user_id, msg.user.profile_version,
+                   msg.like_count, bool(liked))
+
+        items = self.state()
+        variants = items.get(msg.id)
+        if variants is not None and version in variants:
+            return variants[version]
+
+        html = Markup(current_app.jinja_env.get_template(ITEM_TEMPLATE)
+                      .render(msg=msg, liked=bool(liked)))
+
+        with self._lock:
+            variants = items.get(msg.id) or {}
+            # Keep the other liked-state, but only if nothing else changed.
+            variants = {key: value for key, value in variants.items()
+                        if key[:-1] == version[:-1]}
+            variants[version] = html
+            items.set(msg.id, variants)
+
+        return html
+
+    def forget(self, message_id):
+        """Drop the cached items for a deleted message."""
+
+        self.state().pop(message_id)
+
+    def clear(self):
+        self.state().clear()
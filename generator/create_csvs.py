@@ -3,6 +3,8 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+For larger (or offline, reproducible) data sets use generate.py instead.
 """
 
 import csv
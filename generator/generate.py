@@ -0,0 +1,183 @@
+"""Generate Warbler CSVs offline, at any size, from a random seed.
+
+Unlike create_csvs.py this needs no network access and no Faker, the same
+seed always produces the same files, and rows are streamed to disk so it
+scales to millions of rows. Who follows whom and who posts follow a
+power law: a few users have most of the followers and write most of the
+messages, as on real networks.
+
+    python generator/generate.py --users 100000 --messages 2000000 \
+        --follows 5000000 --seed 1
+
+Every generated user's password is "password".
+"""
+
+import argparse
+import csv
+import os
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+from random import Random
+
+MAX_WARBLER_LENGTH = 140
+
+USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+
+# bcrypt hash (cost 12) of "password"
+PASSWORD_HASH = '$2b$12$FQTuLazHRg4ZlkbyiN3u2eHJyYV50.F.QQtM8g93ULDFXEj5Ur1Qi'
+
+WORDS = """
+    able about above across after again against almost alone along already
+    always among animal answer anything area around away back bird black
+    blue body book both bright brown build call came carry center change
+    city close cold color come country course cover cross dark day deep
+    different door down draw early earth east easy edge else end enough
+    even every eye face fact fall family farm fast field fire first fish
+    flight fly follow food form found free friend front full game garden
+    give glass go gold good great green ground group grow half hand happy
+    hard head hear heart heat heavy high hill hold home hope horse hot
+    hour house idea island keep kind king land large last late laugh learn
+    leave light line list little live long look love low machine main make
+    many map mark mean measure might mile mind minute miss money month moon
+    more morning mountain move music name near need nest never new next
+    night north note nothing notice number ocean often old open order other
+    paper part party pass people picture piece place plain plan plant play
+    point power press pull question quick quiet rain reach read ready real
+    record red remember rest right river road rock room round run sail
+    same sand say school sea season second seed send serve shape ship short
+    show side sign simple sing sky sleep slow small snow song soon sound
+    south space speak special spring stand star start stay step still stone
+    stop story street strong study summer sun sure table tail talk tell
+    test thing think thought through time today together town travel tree
+    true turn under until voice wait walk warm watch water wave weather
+    west while white whole wind window winter wing wonder wood word work
+    world write year yellow young
+""".split()
+
+PLACES = ['North', 'South', 'East', 'West', 'New', 'Port', 'Lake', 'Mount', 'Fort', 'Glen']
+PLACE_ENDINGS = ['ton', 'ville', 'burgh', 'field', 'ford', 'wood', 'haven', 'port', 'mouth', 'dale']
+
+
+def power_law_weights(n, exponent):
+    """Cumulative weights for picking 1..n, where id k has weight 1/k**exponent."""
+
+    return list(accumulate(1 / k ** exponent for k in range(1, n + 1)))
+
+
+def pick(rng, cumulative):
+    """A 1-based id drawn using `cumulative` weights."""
+
+    return bisect(cumulative, rng.random() * cumulative[-1]) + 1
+
+
+def sentence(rng, max_length):
+    """A random run of words, capitalized and at most `max_length` long."""
+
+    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 24))]
+    return ' '.join(words).capitalize()[:max_length - 1] + '.'
+
+
+def write_users(path, rng, num_users):
+    with open(path, 'w', newline='') as users_csv:
+        writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
+        writer.writeheader()
+
+        for i in range(1, num_users + 1):
+            username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{i}"
+            writer.writerow(dict(
+                email=f"{username}@example.com",
+                username=username,
+                image_url='/static/images/default-pic.png',
+                password=PASSWORD_HASH,
+                bio=sentence(rng, 100),
+                header_image_url='/static/images/warbler-hero.jpg',
+                location=rng.choice(PLACES) + ' ' + rng.choice(WORDS).capitalize() + rng.choice(PLACE_ENDINGS),
+            ))
+
+
+def write_messages(path, rng, num_messages, num_users, exponent, years):
+    # Prolific authors are scattered across ids rather than being ids 1, 2...
+    authors = list(range(1, num_users + 1))
+    rng.shuffle(authors)
+    cumulative = power_law_weights(num_users, exponent)
+
+    now = datetime(2024, 1, 1)
+    span = timedelta(days=365 * years).total_seconds()
+
+    with open(path, 'w', newline='') as messages_csv:
+        writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
+        writer.writeheader()
+
+        for _ in range(num_messages):
+            writer.writerow(dict(
+                text=sentence(rng, MAX_WARBLER_LENGTH),
+                timestamp=now - timedelta(seconds=rng.random() * span),
+                user_id=authors[pick(rng, cumulative) - 1],
+            ))
+
+
+def write_follows(path, rng, num_follows, num_users, exponent):
+    """Follows where popularity follows a power law.
+
+    Each user follows about the same number of others, but whom they
+    follow is drawn by popularity, so followers pile up on a few users.
+    Pairs are deduplicated per follower, so memory stays proportional to
+    one user's follows.
+    """
+
+    celebrities = list(range(1, num_users + 1))
+    rng.shuffle(celebrities)
+    cumulative = power_law_weights(num_users, exponent)
+
+    per_user, extra = divmod(min(num_follows, num_users * (num_users - 1)), num_users)
+
+    with open(path, 'w', newline='') as follows_csv:
+        writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
+        writer.writeheader()
+
+        for follower in range(1, num_users + 1):
+            wanted = per_user + (1 if follower <= extra else 0)
+            followed = set()
+            attempts = 0
+            while len(followed) < wanted:
+                # Popular users saturate quickly; fall back to uniform picks.
+                if attempts < wanted * 4:
+                    candidate = celebrities[pick(rng, cumulative) - 1]
+                else:
+                    candidate = rng.randint(1, num_users)
+                attempts += 1
+                if candidate != follower:
+                    followed.add(candidate)
+
+            for followed_id in sorted(followed):
+                writer.writerow(dict(user_being_followed_id=followed_id, user_following_id=follower))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--exponent', type=float, default=1.1,
+                        help="power-law exponent for popularity (higher is more skewed)")
+    parser.add_argument('--years', type=int, default=2,
+                        help="spread message timestamps over this many years")
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory to write users.csv, messages.csv and follows.csv to")
+    args = parser.parse_args(argv)
+
+    rng = Random(args.seed)
+
+    write_users(os.path.join(args.out, 'users.csv'), rng, args.users)
+    write_messages(os.path.join(args.out, 'messages.csv'), rng,
+                   args.messages, args.users, args.exponent, args.years)
+    write_follows(os.path.join(args.out, 'follows.csv'), rng,
+                  args.follows, args.users, args.exponent)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Gunicorn settings for serving Warbler; picked up by `gunicorn app:app`.
+
+Most of a Warbler request is spent waiting on PostgreSQL, so a sync
+worker mostly sits idle and throughput tops out at workers / round-trip
+time. WARBLER_SERVER picks how each worker overlaps that waiting:
+
+- sync: one request at a time per process (gunicorn's default).
+- gthread: WEB_THREADS requests at a time per process, on threads.
+- gevent: up to WEB_CONNECTIONS requests per process, on greenlets.
+  psycogreen makes psycopg2 yield to other greenlets while it waits
+  for the database.
+
+With gthread or gevent, each worker needs enough pooled connections for
+its concurrent requests (DB_POOL_SIZE + DB_MAX_OVERFLOW), and the
+database must allow WEB_WORKERS times that. benchmark.py --url compares
+the profiles against a running server.
+
+    WARBLER_ENV=prod WARBLER_SERVER=gevent gunicorn app:app
+"""
+
+import multiprocessing
+import os
+
+profile = os.environ.get('WARBLER_SERVER', 'sync')
+
+if profile == 'gevent':
+    # Before anything imports the app: with preload_app, its locks, events
+    # and pools are made in the master, and must already be gevent's.
+    from gevent import monkey
+    monkey.patch_all()
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+
+# Load the app once in the master, so workers fork with it imported.
+preload_app = True
+
+if profile == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 8))
+elif profile == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WEB_CONNECTIONS', 100))
+elif profile != 'sync':
+    raise RuntimeError(f"WARBLER_SERVER must be sync, gthread or gevent, not {profile!r}")
+
+
+def pre_fork(server, worker):
+    """Fork workers without any of the master's database connections.
+
+    Connections opened while preloading would otherwise be shared by
+    every worker; the master closes them instead, and each worker opens
+    its own.
+    """
+
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.engine.dispose()
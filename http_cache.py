@@ -0,0 +1,159 @@
+"""HTTP caching policy for Warbler.
+
+- Static files: URLs built with url_for('static', ...) get a `v` query
+  argument from the file's modification time, and are served with a
+  year-long immutable Cache-Control. Unversioned static URLs (such as the
+  default avatar paths stored in the database) are cached for
+  STATIC_MAX_AGE seconds and revalidated after that.
+- Pages whose content is derived from a few row versions (profiles,
+  single messages) get an ETag and Last-Modified; views call
+  `not_modified()` before running their queries and rendering, and answer
+  a matching conditional request with a bare 304.
+- Everything else keeps the old "never cache" headers: pages show the
+  logged-in user's state.
+"""
+
+import os
+from collections import namedtuple
+from datetime import timezone
+from hashlib import sha1
+
+from flask import Response, current_app, request, session
+
+from appstate import AppExtension
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+Validators = namedtuple('Validators', ['etag', 'last_modified'])
+
+
+def http_date(dt):
+    """`dt` as a naive UTC datetime, to the second (HTTP date precision)."""
+
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.replace(microsecond=0)
+
+
+def newest(*timestamps):
+    """The latest of `timestamps`, ignoring Nones (None if all are)."""
+
+    return max((ts for ts in timestamps if ts is not None), default=None)
+
+
+def page_validators(*parts, last_modified=None):
+    """Validators for a page that depends only on `parts`.
+
+    `parts` should name the page and every version or id that changes what
+    it shows, including the viewer's. `last_modified` is the newest of the
+    relevant timestamps (naive UTC), or None.
+    """
+
+    key = repr((current_app.extensions['http_cache'].templates_version,) + parts)
+    etag = sha1(key.encode()).hexdigest()[:20]
+    return Validators(etag, last_modified and http_date(last_modified))
+
+
+def not_modified(validators):
+    """A 304 response if the client already has this version, else None.
+
+    Never a 304 while flash messages are waiting: the client's copy
+    doesn't show them.
+    """
+
+    if '_flashes' in session:
+        return None
+
+    if request.if_none_match:
+        matches = request.if_none_match.contains(validators.etag)
+    elif request.if_modified_since and validators.last_modified:
+        matches = validators.last_modified <= http_date(request.if_modified_since)
+    else:
+        matches = False
+
+    if matches:
+        return add_validators(Response(status=304), validators)
+    return None
+
+
+def add_validators(response, validators):
+    """Add the page's ETag and Last-Modified to `response`.
+
+    The page is per user, so only the browser may keep it, and must check
+    back every time; a 304 makes that check cheap.
+    """
+
+    response.set_etag(validators.etag)
+    if validators.last_modified:
+        response.last_modified = validators.last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class HTTPCacheState:
+    """One app's template version, and static file versions seen so far."""
+
+    def __init__(self, templates_version):
+        self.templates_version = templates_version
+        self.static_versions = {}
+
+
+class HTTPCache(AppExtension):
+    """Flask extension installing the caching policy."""
+
+    name = 'http_cache'
+
+    def __init__(self, app=None):
+        super().__init__()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_MAX_AGE', 60 * 60)
+
+        # Part of every page ETag, so a deploy with changed templates
+        # doesn't keep serving 304s for the old markup.
+        mtimes = [os.path.getmtime(os.path.join(root, name))
+                  for root, _, names in os.walk(os.path.join(app.root_path, app.template_folder))
+                  for name in names]
+        self.bind(app, HTTPCacheState(int(max(mtimes, default=0))))
+
+        app.url_defaults(self.version_static_url)
+        app.after_request(self.set_cache_headers)
+
+    def static_version(self, filename):
+        """A token that changes whenever static file `filename` does."""
+
+        versions = self.state().static_versions
+        version = versions.get(filename)
+        if version is None or current_app.debug:
+            try:
+                mtime = os.path.getmtime(os.path.join(current_app.static_folder, filename))
+            except OSError:
+                return None
+            version = versions[filename] = f"{int(mtime):x}"
+        return version
+
+    def version_static_url(self, endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            version = self.static_version(values.get('filename', ''))
+            if version:
+                values['v'] = version
+
+    def set_cache_headers(self, response):
+        if request.endpoint == 'static':
+            if 'v' in request.args:
+                response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+            else:
+                max_age = current_app.config['STATIC_MAX_AGE']
+                response.headers['Cache-Control'] = f'public, max-age={max_age}'
+            response.headers.pop('Expires', None)
+
+        elif response.get_etag() == (None, None):
+            # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
+
+        return response
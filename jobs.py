@@ -0,0 +1,233 @@
+"""Background jobs, queued in the database.
+
+Views hand off work that needn't finish before the response with
+`jobs.enqueue(task, *args)`. The job row is written in the view's own
+transaction, so a job exists exactly when the write it belongs to
+committed; `jobs.notify()` after the commit wakes a worker.
+
+Workers claim due jobs one at a time (with SKIP LOCKED on PostgreSQL, so
+any number can share the table) and run them. A job that raises is
+retried after JOBS_RETRY_DELAY seconds, doubling each time, and marked
+failed, with its error kept, after JOBS_MAX_ATTEMPTS tries.
+
+Jobs run at least once: one whose worker died mid-run is claimed again
+after JOBS_LOCK_TIMEOUT seconds, so tasks must be safe to repeat. Tasks
+that can run longer than that call `heartbeat()` as they go. An
+idempotency `key` makes enqueueing safe to repeat too: a job whose key
+is already in the table is dropped. Workers delete finished jobs after
+JOBS_KEEP_SECONDS, which is also how long a key keeps its job from
+being queued again; failed ones are kept for inspection.
+
+Workers run as JOBS_WORKERS threads in each app process (0 for none),
+started by the first `notify()`, and in `flask worker`. JOBS_INLINE runs
+queued jobs in the notifying thread instead (tests).
+
+Tasks run in whichever process picks them up, so what they do to
+in-process caches only reaches that process's. Queued work is therefore
+database writes plus cache invalidation the other processes can wait
+out: the purge of a deleted account (purge.py) and counter repairs
+after deleting a message (actions.py). Timeline fan-out is queued only
+with a shared timeline backend (see timeline.py); with the default
+in-process one, views run it themselves after their commit. Likes and
+follows still write inline, since their responses show the result.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+import click
+from flask import g
+from sqlalchemy import and_, or_
+
+from appstate import AppExtension
+from models import db, Job
+
+
+class WorkerThreads:
+    """One app's in-process workers: whether they're started, and their wake-up call."""
+
+    def __init__(self):
+        self.wakeup = Event()
+        self.pid = None
+        self.lock = Lock()
+
+
+class JobQueue(AppExtension):
+    """Flask extension queueing and running background jobs (see module docstring).
+
+    Tasks are registered once, for every app; each app has its own workers.
+    """
+
+    name = 'jobs'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self.tasks = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_INLINE', False)
+        app.config.setdefault('JOBS_WORKERS', 1)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 5)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOBS_RETRY_DELAY', 10)
+        app.config.setdefault('JOBS_LOCK_TIMEOUT', 600)
+        app.config.setdefault('JOBS_KEEP_SECONDS', 86400)
+
+        @app.cli.command('worker')
+        @click.option('--burst', is_flag=True, help="Exit once no jobs are due.")
+        def worker(burst):
+            """Run background jobs until stopped."""
+
+            self.work(app, burst=burst)
+
+        self.bind(app, WorkerThreads())
+
+    def task(self, name):
+        """Register the decorated function as the task `name`."""
+
+        def decorator(f):
+            self.tasks[name] = f
+            return f
+        return decorator
+
+    def enqueue(self, task, *args, key=None):
+        """Queue `task(*args)` in the current transaction.
+
+        Returns False if a job with `key` already exists. Call `notify()`
+        once the transaction is committed.
+        """
+
+        if task not in self.tasks:
+            raise LookupError(f"No task named {task!r}")
+        return bool(Job.add(task, json.dumps(args), key))
+
+    def notify(self):
+        """Tell the workers there's new work (or, inline, do it now)."""
+
+        app = self.get_app()
+        if app.config['JOBS_INLINE']:
+            self.run_pending()
+        elif app.config['JOBS_WORKERS']:
+            self.start_threads(app)
+            app.extensions[self.name].wakeup.set()
+
+    def claim(self):
+        """Mark the next due job running and return it, or None if none is due."""
+
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.get_app().config['JOBS_LOCK_TIMEOUT'])
+
+        query = (Job.query
+                 .filter(or_(and_(Job.status == Job.QUEUED, Job.run_at <= now),
+                             and_(Job.status == Job.RUNNING, Job.locked_at < stale)))
+                 .order_by(Job.run_at, Job.id))
+        if db.session.get_bind().dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+
+        job = query.first()
+        if job is None:
+            db.session.rollback()
+            return None
+
+        job.status = Job.RUNNING
+        job.locked_at = now
+        job.attempts += 1
+        db.session.commit()
+        return job
+
+    def run(self, job):
+        """Run a claimed job, then record it as done or schedule a retry."""
+
+        app = self.get_app()
+        job_id, task, attempts = job.id, job.task, job.attempts
+
+        g.job_id = job_id
+        try:
+            self.tasks[task](*json.loads(job.args))
+        except Exception as exc:
+            db.session.rollback()
+            app.logger.exception("Job %s (%s) failed", job_id, task)
+
+            if attempts >= app.config['JOBS_MAX_ATTEMPTS']:
+                changes = {Job.status: Job.FAILED, Job.finished_at: datetime.utcnow()}
+            else:
+                delay = app.config['JOBS_RETRY_DELAY'] * 2 ** (attempts - 1)
+                changes = {Job.status: Job.QUEUED,
+                           Job.run_at: datetime.utcnow() + timedelta(seconds=delay)}
+            changes.update({Job.locked_at: None, Job.last_error: repr(exc)})
+        else:
+            changes = {Job.status: Job.DONE, Job.finished_at: datetime.utcnow(),
+                       Job.locked_at: None}
+        finally:
+            g.pop('job_id', None)
+
+        Job.query.filter(Job.id == job_id).update(changes, synchronize_session=False)
+        db.session.commit()
+
+    def heartbeat(self):
+        """Renew the lock on the job this thread is running, in the current
+        transaction, so it isn't reclaimed while still making progress."""
+
+        job_id = g.get('job_id')
+        if job_id is not None:
+            (Job.query
+                .filter(Job.id == job_id)
+                .update({Job.locked_at: datetime.utcnow()}, synchronize_session=False))
+
+    def prune(self):
+        """Delete jobs finished more than JOBS_KEEP_SECONDS ago; returns how many."""
+
+        cutoff = datetime.utcnow() - timedelta(
+            seconds=self.get_app().config['JOBS_KEEP_SECONDS'])
+        count = (Job.query
+                 .filter(Job.status == Job.DONE, Job.finished_at < cutoff)
+                 .delete(synchronize_session=False))
+        db.session.commit()
+        return count
+
+    def run_pending(self):
+        """Run jobs until none is due; returns how many ran."""
+
+        count = 0
+        while True:
+            job = self.claim()
+            if job is None:
+                return count
+            self.run(job)
+            count += 1
+
+    def work(self, app, burst=False):
+        """Run `app`'s jobs as they come due; with `burst`, stop once none is."""
+
+        wakeup = app.extensions[self.name].wakeup
+
+        while True:
+            try:
+                with app.app_context():
+                    ran = self.run_pending()
+                    self.prune()
+            except Exception:
+                # e.g. the database is down; try again after a pause.
+                app.logger.exception("Job worker failed")
+                ran = 0
+            if burst:
+                if not ran:
+                    return
+                continue
+            wakeup.wait(app.config['JOBS_POLL_INTERVAL'])
+            wakeup.clear()
+
+    def start_threads(self, app):
+        """Start this process's worker threads for `app`, once (again after a fork)."""
+
+        threads = app.extensions[self.name]
+        with threads.lock:
+            if threads.pid != os.getpid():
+                for _ in range(app.config['JOBS_WORKERS']):
+                    Thread(target=self.work, args=(app,), daemon=True).start()
+                threads.pid = os.getpid()
@@ -0,0 +1,198 @@
+"""Per-request SQL instrumentation for Warbler.
+
+Counts the queries each request runs and the time spent in them (by
+hooking SQLAlchemy's cursor events), then:
+
+- adds a Server-Timing header to every response, so browser dev tools
+  show DB time next to network time;
+- keeps running totals per endpoint, served in Prometheus text format at
+  /metrics (totals are per process: scrape each worker), plus each
+  endpoint's slowest statement at /metrics/slowest in debug mode only,
+  since statements can reveal more than counters;
+- logs a warning for requests slower than SLOW_REQUEST_MS or running
+  more than SLOW_REQUEST_QUERIES queries, with their slowest statement.
+
+Only bookkeeping happens per query, so it's cheap enough to leave on in
+production.
+"""
+
+from collections import defaultdict
+from threading import Lock
+from time import perf_counter
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from appstate import AppExtension
+
+# Longest statement kept for the slow-request log and /metrics/slowest.
+MAX_STATEMENT_LENGTH = 300
+
+
+class RequestStats:
+    """What one request did in the database."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+
+class EndpointTotals:
+    """Running totals for one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.request_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_stats' in g:
+        conn.info.setdefault('query_started', []).append(perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started and has_request_context() and 'query_stats' in g:
+        g.query_stats.record(statement, perf_counter() - started.pop())
+
+
+class QueryMetrics(AppExtension):
+    """Flask extension wiring the instrumentation into an app.
+
+    Each app keeps its own totals, a dict of `EndpointTotals` by endpoint.
+    """
+
+    name = 'query_metrics'
+
+    def __init__(self, app=None):
+        super().__init__()
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_REQUEST_MS', 500)
+        app.config.setdefault('SLOW_REQUEST_QUERIES', 50)
+        app.config.setdefault('METRICS_ENDPOINT', True)
+
+        # Listening on the Engine class covers every engine, including
+        # ones Flask-SQLAlchemy hasn't created yet.
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+        if app.config['METRICS_ENDPOINT']:
+            app.add_url_rule('/metrics', 'metrics', self.metrics)
+            app.add_url_rule('/metrics/slowest', 'metrics_slowest', self.slowest)
+
+        self.bind(app, defaultdict(EndpointTotals))
+
+    def start_request(self):
+        g.query_stats = RequestStats()
+
+    def finish_request(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+
+        elapsed = perf_counter() - stats.started
+        endpoint = request.endpoint or 'unknown'
+
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+            f'app;dur={elapsed * 1000:.1f}')
+
+        with self._lock:
+            totals = self.state()[endpoint]
+            totals.requests += 1
+            totals.queries += stats.queries
+            totals.db_seconds += stats.db_seconds
+            totals.request_seconds += elapsed
+            if stats.slowest_seconds >= totals.slowest_seconds:
+                totals.slowest_seconds = stats.slowest_seconds
+                totals.slowest_statement = stats.slowest_statement
+
+        config = current_app.config
+        if (elapsed * 1000 > config['SLOW_REQUEST_MS']
+                or stats.queries > config['SLOW_REQUEST_QUERIES']):
+            current_app.logger.warning(
+                "Slow request %s %s (%s): %.0fms, %d queries, %.0fms in DB; "
+                "slowest query %.0fms: %s",
+                request.method, request.path, endpoint, elapsed * 1000,
+                stats.queries, stats.db_seconds * 1000, stats.slowest_seconds * 1000,
+                (stats.slowest_statement or '')[:MAX_STATEMENT_LENGTH])
+
+        return response
+
+    def render(self):
+        """Current totals in Prometheus text exposition format."""
+
+        with self._lock:
+            totals = sorted(self.state().items())
+
+        series = [
+            ('warbler_requests_total', 'counter', "Requests handled.",
+             lambda t: t.requests),
+            ('warbler_request_seconds_total', 'counter', "Time spent handling requests.",
+             lambda t: t.request_seconds),
+            ('warbler_db_queries_total', 'counter', "SQL statements executed.",
+             lambda t: t.queries),
+            ('warbler_db_seconds_total', 'counter', "Time spent executing SQL.",
+             lambda t: t.db_seconds),
+            ('warbler_db_slowest_query_seconds', 'gauge', "Slowest single SQL statement seen.",
+             lambda t: t.slowest_seconds),
+        ]
+
+        lines = []
+        for name, kind, help, value in series:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for endpoint, endpoint_totals in totals:
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {value(endpoint_totals)}')
+
+        return '\n'.join(lines) + '\n'
+
+    def metrics(self):
+        """Serve the totals to a Prometheus scraper."""
+
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def slowest(self):
+        """Each endpoint's slowest statement, for a developer; 404 unless debugging."""
+
+        if not current_app.debug:
+            abort(404)
+
+        with self._lock:
+            totals = sorted(self.state().items())
+
+        lines = [f"{endpoint} {endpoint_totals.slowest_seconds * 1000:.1f}ms "
+                 f"{(endpoint_totals.slowest_statement or '')[:MAX_STATEMENT_LENGTH]}"
+                 for endpoint, endpoint_totals in totals]
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+    def reset(self):
+        """Forget all totals."""
+
+        with self._lock:
+            self.state().clear()
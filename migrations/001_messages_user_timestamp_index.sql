@@ -0,0 +1,13 @@
+-- Index messages by author, newest first, for the home timeline and
+-- profile pages; `id` breaks timestamp ties for the keyset cursor. Run
+-- against an existing database with
+--
+--     psql warbler -f migrations/001_messages_user_timestamp_index.sql
+--
+-- CONCURRENTLY keeps messages writable while the index builds, so this
+-- can't run inside a transaction. A database that already has the older
+-- (user_id, timestamp) version of this index needs
+-- `DROP INDEX CONCURRENTLY ix_messages_user_id_timestamp;` first.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_timestamp
+    ON messages (user_id, timestamp, id);
@@ -0,0 +1,23 @@
+-- Keep follower, following, message and like counts on each user, so
+-- profile cards don't count related rows. Run against an existing
+-- database with
+--
+--     psql warbler -f migrations/004_user_counters.sql
+--
+-- `flask recount` rebuilds the counts at any time.
+
+BEGIN;
+
+ALTER TABLE users
+    ADD COLUMN messages_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN following_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN followers_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN likes_count integer NOT NULL DEFAULT 0;
+
+UPDATE users u
+SET messages_count = (SELECT count(*) FROM messages WHERE user_id = u.id),
+    following_count = (SELECT count(*) FROM follows WHERE user_following_id = u.id),
+    followers_count = (SELECT count(*) FROM follows WHERE user_being_followed_id = u.id),
+    likes_count = (SELECT count(*) FROM likes WHERE user_id = u.id);
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Trigram indexes for the user search (see search.py). Run against an
+-- existing database with
+--
+--     psql warbler -f migrations/007_user_search_trgm.sql
+--
+-- Creating the pg_trgm extension needs a role allowed to. CONCURRENTLY
+-- keeps users writable while the indexes build, so this can't run inside
+-- a transaction.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm
+    ON users USING gin (username gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_bio_trgm
+    ON users USING gin (bio gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_location_trgm
+    ON users USING gin (location gin_trgm_ops);
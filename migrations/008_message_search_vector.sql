@@ -0,0 +1,22 @@
+-- Full-text search over messages (see search.py): a search_vector column
+-- kept current by a trigger, and a GIN index on it. Run against an
+-- existing database with
+--
+--     psql warbler -f migrations/008_message_search_vector.sql
+--
+-- The backfill rewrites every message, so run it at a quiet time.
+
+BEGIN;
+
+ALTER TABLE messages ADD COLUMN search_vector tsvector;
+
+CREATE TRIGGER messages_search_vector_update
+BEFORE INSERT OR UPDATE OF text ON messages
+FOR EACH ROW EXECUTE PROCEDURE
+tsvector_update_trigger(search_vector, 'pg_catalog.english', text);
+
+UPDATE messages SET search_vector = to_tsvector('pg_catalog.english', text);
+
+CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector);
+
+COMMIT;
@@ -0,0 +1,12 @@
+-- Version and timestamp users' rows, for page ETags and Last-Modified
+-- (see http_cache.py). Run against an existing database with
+--
+--     psql warbler -f migrations/014_user_profile_version.sql
+
+BEGIN;
+
+ALTER TABLE users
+    ADD COLUMN profile_version integer NOT NULL DEFAULT 0,
+    ADD COLUMN updated_at timestamp DEFAULT timezone('utc', now());
+
+COMMIT;
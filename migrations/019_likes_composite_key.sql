@@ -0,0 +1,28 @@
+-- Key likes by (user_id, message_id) instead of a surrogate id.
+--
+-- Before this, likes.message_id was UNIQUE, so each message could only
+-- ever be liked by one user. Run against an existing database with
+--
+--     psql warbler -f migrations/019_likes_composite_key.sql
+--
+-- then `flask recount` to rebuild users.likes_count.
+
+BEGIN;
+
+-- Rows the new key can't hold: incomplete ones and duplicates.
+DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL;
+
+DELETE FROM likes a
+USING likes b
+WHERE a.user_id = b.user_id
+  AND a.message_id = b.message_id
+  AND a.id > b.id;
+
+ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key;
+ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_pkey;
+ALTER TABLE likes DROP COLUMN id;
+
+ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id);
+CREATE INDEX ix_likes_message_id ON likes (message_id);
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Keep a like count on each message, so message lists don't count likes
+-- per message. Run against an existing database with
+--
+--     psql warbler -f migrations/020_message_like_count.sql
+--
+-- `flask recount` rebuilds the counts at any time.
+
+BEGIN;
+
+ALTER TABLE messages ADD COLUMN like_count integer NOT NULL DEFAULT 0;
+
+UPDATE messages m
+SET like_count = l.count
+FROM (SELECT message_id, count(*) AS count FROM likes GROUP BY message_id) l
+WHERE l.message_id = m.id;
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- Index follows by follower, for "who does X follow" (the following page
+-- and the home timeline). The primary key only covers "who follows X".
+-- Run against an existing database with
+--
+--     psql warbler -f migrations/021_follows_reverse_index.sql
+--
+-- CONCURRENTLY keeps follows writable while the index builds, so this
+-- can't run inside a transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_user_following_id
+    ON follows (user_following_id, user_being_followed_id);
@@ -0,0 +1,17 @@
+-- Tombstone deleted users and track purging their rows (see purge.py).
+-- Run against an existing database with
+--
+--     psql warbler -f migrations/022_user_deletions.sql
+
+BEGIN;
+
+ALTER TABLE users ADD COLUMN deleted_at timestamp;
+
+CREATE TABLE deletions (
+    user_id integer PRIMARY KEY,
+    requested_at timestamp NOT NULL,
+    rows_deleted integer NOT NULL,
+    finished_at timestamp
+);
+
+COMMIT;
@@ -0,0 +1,24 @@
+-- Queue table for background jobs (see jobs.py). Run against an existing
+-- database with
+--
+--     psql warbler -f migrations/023_jobs.sql
+
+BEGIN;
+
+CREATE TABLE jobs (
+    id serial PRIMARY KEY,
+    task varchar(100) NOT NULL,
+    args text NOT NULL,
+    key varchar(200) UNIQUE,
+    status varchar(10) NOT NULL,
+    attempts integer NOT NULL,
+    run_at timestamp NOT NULL,
+    locked_at timestamp,
+    last_error text,
+    created_at timestamp NOT NULL,
+    finished_at timestamp
+);
+
+CREATE INDEX ix_jobs_status_run_at ON jobs (status, run_at);
+
+COMMIT;
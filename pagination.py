@@ -0,0 +1,112 @@
+"""Keyset ("cursor") pagination over messages and follows for Warbler.
+
+Message lists are ordered newest first by (timestamp, id). A page ends with
+a cursor naming its last message; the next page is everything strictly
+older than that, which the database answers with an index range scan
+however deep the reader pages (unlike OFFSET, which rescans every row it
+skips).
+
+Following and follower lists are ordered by user id, the second column of
+the follows index for each direction, and their cursor is the last id.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import Follows, Message, User
+
+PER_PAGE = 100
+USERS_PER_PAGE = 48
+
+# `liked_ids`: which items the viewer has liked, when the page was asked for it.
+Page = namedtuple('Page', ['items', 'next_cursor', 'liked_ids'], defaults=[None])
+
+
+def encode_cursor(message):
+    """Opaque, URL-safe cursor pointing just past `message`."""
+
+    raw = f"{message.timestamp.isoformat()},{message.id}"
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into (timestamp, id); None if it isn't valid."""
+
+    if not cursor:
+        return None
+
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, id = raw.split(',')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (Base64Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def paginate(query, before=None, per_page=PER_PAGE, liked_by=None):
+    """One page of the messages in `query`, newest first.
+
+    `before` is a cursor from a previous page (an invalid one is treated as
+    no cursor). Fetches one extra row to know whether an older page exists.
+    With `liked_by` (a user id), the same query also finds which of the
+    page's messages that user has liked, for `Page.liked_ids`.
+    """
+
+    position = decode_cursor(before)
+    if position:
+        timestamp, id = position
+        # A row comparison, unlike the equivalent OR, bounds the scan of
+        # the (user_id, timestamp, id) index.
+        query = query.filter(tuple_(Message.timestamp, Message.id) < tuple_(timestamp, id))
+
+    if liked_by is not None:
+        query = Message.with_liked(query, liked_by)
+
+    rows = (query
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(per_page + 1)
+            .all())
+
+    liked_ids = None
+    if liked_by is not None:
+        liked_ids = {msg.id for msg, liked in rows if liked}
+        rows = [msg for msg, liked in rows]
+
+    if len(rows) > per_page:
+        messages = rows[:per_page]
+        return Page(messages, encode_cursor(messages[-1]), liked_ids)
+
+    return Page(rows, None, liked_ids)
+
+
+def paginate_follows(user_id, followers=False, after=None, per_page=USERS_PER_PAGE):
+    """One page of the users `user_id` follows (or, with `followers`, its
+    followers), by ascending id.
+
+    `after` is the `next_cursor` of the previous page. Only the page's rows
+    are read, however many follows the user has. Deleted users are left
+    out until their follows are purged.
+    """
+
+    if followers:
+        key, other = Follows.user_being_followed_id, Follows.user_following_id
+    else:
+        key, other = Follows.user_following_id, Follows.user_being_followed_id
+
+    query = (User.query
+             .join(Follows, other == User.id)
+             .filter(key == user_id, User.deleted_at.is_(None)))
+    if after is not None:
+        query = query.filter(other > after)
+
+    users = query.order_by(other).limit(per_page + 1).all()
+
+    if len(users) > per_page:
+        users = users[:per_page]
+        return Page(users, users[-1].id)
+
+    return Page(users, None)
@@ -0,0 +1,75 @@
+"""Running a request's independent queries at the same time.
+
+A page that needs several queries which don't depend on each other
+waits for the sum of their round trips if it runs them one after
+another. `gather()` runs them side by side, each on its own pooled
+connection and session, so the page waits for the slowest one.
+
+Calls run on a small per-process thread pool (PARALLEL_QUERY_THREADS
+threads; under gevent these are greenlets). ORM objects they return are
+merged into the request's session without a query, so lazy loads on
+them work as usual; anything else comes back as is. Calls get an app
+context but no request (so no `g`), and must only read: each one's
+session is thrown away when it returns.
+
+With PARALLEL_QUERIES off, or on SQLite (the tests), calls simply run
+one after another in the request's own session.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from flask import current_app
+
+from models import db
+
+_executor = None
+_executor_pid = None
+_executor_lock = Lock()
+
+
+def executor():
+    """This process's query pool, started on first use (and after a fork)."""
+
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('PARALLEL_QUERY_THREADS', 4))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def enabled():
+    return (current_app.config.get('PARALLEL_QUERIES', False)
+            and db.session.get_bind().dialect.name != 'sqlite')
+
+
+def attach(result):
+    """`result`, with any ORM instances in it merged into this session."""
+
+    if isinstance(result, db.Model):
+        return db.session.merge(result, load=False)
+    if isinstance(result, list) and result and isinstance(result[0], db.Model):
+        return [db.session.merge(item, load=False) for item in result]
+    if isinstance(result, tuple) and hasattr(result, '_fields'):
+        return type(result)(*(attach(item) for item in result))
+    return result
+
+
+def gather(*calls):
+    """Run the no-argument callables `calls` concurrently; returns their results in order."""
+
+    if len(calls) < 2 or not enabled():
+        return [call() for call in calls]
+
+    app = current_app._get_current_object()
+
+    def run(call):
+        with app.app_context():
+            return call()
+
+    futures = [executor().submit(run, call) for call in calls]
+    return [attach(future.result()) for future in futures]
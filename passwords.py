@@ -0,0 +1,154 @@
+"""Password hashing off the request threads.
+
+bcrypt is deliberately slow, so a burst of logins or signups can pin
+every worker on CPU and starve ordinary page views. `PasswordHasher`
+runs it in a small process pool instead, and refuses new work with a
+503 once BCRYPT_MAX_PENDING hashes are already queued or running, so a
+login storm is shed quickly rather than queueing behind itself.
+
+Settings:
+
+- BCRYPT_LOG_ROUNDS: the cost for new hashes. Hashes made with another
+  cost still check, and are rehashed on the user's next login.
+- BCRYPT_WORKERS: processes in the pool (per app process).
+- BCRYPT_MAX_PENDING: hashes allowed in flight before answering 503.
+- BCRYPT_INLINE: hash in the calling thread, with no pool (tests).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+from appstate import AppExtension
+
+
+class HashingBusy(ServiceUnavailable):
+    """Too many password hashes in flight; the client should retry."""
+
+    description = "The server is busy signing people in. Please try again in a moment."
+
+    def get_headers(self, *args, **kwargs):
+        headers = super().get_headers(*args, **kwargs)
+        headers.append(('Retry-After', '1'))
+        return headers
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def check_password(pw_hash, password):
+    try:
+        return bcrypt.checkpw(password.encode('UTF-8'), pw_hash.encode('UTF-8'))
+    except ValueError:
+        # Not a bcrypt hash at all.
+        return False
+
+
+def hash_rounds(pw_hash):
+    """The cost a bcrypt hash was made with: $2b$<rounds>$..."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class HasherState:
+    """One app's hashing settings, read once so models can hash outside a
+    request (e.g. when seeding), and its pool."""
+
+    def __init__(self, config):
+        self.rounds = config['BCRYPT_LOG_ROUNDS']
+        self.workers = config['BCRYPT_WORKERS']
+        self.timeout = config['BCRYPT_TIMEOUT']
+        self.inline = config['BCRYPT_INLINE']
+        self.pending = BoundedSemaphore(config['BCRYPT_MAX_PENDING'])
+
+        self.pool = None
+        self.pool_pid = None
+        self.pool_lock = Lock()
+
+
+class PasswordHasher(AppExtension):
+    """Flask extension hashing and checking passwords in a process pool."""
+
+    name = 'passwords'
+
+    def __init__(self, app=None):
+        super().__init__()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('BCRYPT_WORKERS', 2)
+        app.config.setdefault('BCRYPT_MAX_PENDING', app.config['BCRYPT_WORKERS'] * 8)
+        app.config.setdefault('BCRYPT_TIMEOUT', 10)
+        app.config.setdefault('BCRYPT_INLINE', False)
+
+        self.bind(app, HasherState(app.config))
+
+    def pool(self, state):
+        """This process's pool for `state`'s app, started on first use.
+
+        Started lazily, and again after a fork, so gunicorn workers don't
+        share (or leak) the pool of the process that imported the app.
+        """
+
+        with state.pool_lock:
+            if state.pool is None or state.pool_pid != os.getpid():
+                state.pool = ProcessPoolExecutor(max_workers=state.workers)
+                state.pool_pid = os.getpid()
+            return state.pool
+
+    def run(self, fn, *args):
+        state = self.state()
+        if state.inline:
+            return fn(*args)
+
+        pending = state.pending
+        if not pending.acquire(blocking=False):
+            raise HashingBusy()
+
+        try:
+            future = self.pool(state).submit(fn, *args)
+        except BrokenProcessPool:
+            pending.release()
+            state.pool = None
+            raise HashingBusy()
+        # Released when the work is done, not when we stop waiting for it,
+        # so timed out hashes still count against the limit.
+        future.add_done_callback(lambda _: pending.release())
+
+        try:
+            return future.result(timeout=state.timeout)
+        except TimeoutError:
+            raise HashingBusy()
+        except BrokenProcessPool:
+            # A pool process died; start a new pool next time.
+            state.pool = None
+            raise HashingBusy()
+
+    def hash(self, password):
+        """A bcrypt hash of `password` at the configured cost."""
+
+        return self.run(hash_password, password, self.state().rounds)
+
+    def check(self, pw_hash, password):
+        """Whether `password` matches `pw_hash`."""
+
+        return self.run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Whether `pw_hash` was made with a cost other than the current one."""
+
+        return hash_rounds(pw_hash) != self.state().rounds
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,156 @@
+"""Purging deleted accounts.
+
+Deleting an account only tombstones the user (`User.deleted_at`) and
+records a `Deletion`, which takes the same time however much the user
+posted; they're gone from the site from then on. Their rows go
+afterwards, here: likes they gave, their messages and the likes on
+them, their follows both ways, and finally the user row. Each batch of
+at most PURGE_BATCH_SIZE rows is its own short transaction, and adds
+to `Deletion.rows_deleted` so progress can be watched.
+
+The purge is a background job (see jobs.py). Every batch deletes only
+what is still there, so a purge that stops part way (a restart, a
+crash) carries on where it stopped when the job is retried.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+
+from extensions import fragment_cache, jobs, session_users, timeline_cache
+from models import db, User, Message, Likes, Follows, Deletion
+from search import unindex_message
+
+
+def tombstone(user_id):
+    """Mark `user_id` deleted and queue its purge, in the current transaction.
+
+    Commit, then call `jobs.notify()`.
+    """
+
+    (User.query
+        .filter(User.id == user_id)
+        .update({User.deleted_at: datetime.utcnow()}, synchronize_session=False))
+    db.session.add(Deletion(user_id=user_id))
+    jobs.enqueue('purge_user', user_id, key=f'purge_user:{user_id}')
+
+
+def finish_batch(user_id, rows):
+    """Record `rows` more rows purged for `user_id`, and commit the batch."""
+
+    (Deletion.query
+        .filter(Deletion.user_id == user_id)
+        .update({Deletion.rows_deleted: Deletion.rows_deleted + rows},
+                synchronize_session=False))
+    # A big account takes many batches; keep the job from being reclaimed.
+    jobs.heartbeat()
+    db.session.commit()
+
+
+def purge_likes(user_id, batch_size):
+    """Delete a batch of the likes `user_id` gave."""
+
+    message_ids = [id for (id,) in (db.session
+                                    .query(Likes.message_id)
+                                    .filter(Likes.user_id == user_id)
+                                    .limit(batch_size))]
+    if not message_ids:
+        return 0
+
+    (Likes.query
+        .filter(Likes.user_id == user_id, Likes.message_id.in_(message_ids))
+        .delete(synchronize_session=False))
+    Message.recount(message_ids)
+    finish_batch(user_id, len(message_ids))
+    return len(message_ids)
+
+
+def purge_messages(user_id, batch_size):
+    """Delete a batch of `user_id`'s messages, with everyone's likes on them."""
+
+    message_ids = [id for (id,) in (db.session
+                                    .query(Message.id)
+                                    .filter(Message.user_id == user_id)
+                                    .limit(batch_size))]
+    if not message_ids:
+        return 0
+
+    liker_ids = {id for (id,) in (db.session
+                                  .query(Likes.user_id)
+                                  .filter(Likes.message_id.in_(message_ids))
+                                  .distinct())}
+    likes = (Likes.query
+             .filter(Likes.message_id.in_(message_ids))
+             .delete(synchronize_session=False))
+    (Message.query
+        .filter(Message.id.in_(message_ids))
+        .delete(synchronize_session=False))
+    if liker_ids:
+        User.recount(liker_ids)
+    finish_batch(user_id, likes + len(message_ids))
+
+    # Cached timelines skip ids whose messages are gone, so they can keep
+    # them until they're rebuilt.
+    session_users.invalidate(*liker_ids)
+    for message_id in message_ids:
+        fragment_cache.forget(message_id)
+        unindex_message(message_id)
+    return likes + len(message_ids)
+
+
+def purge_follows(user_id, batch_size, followers):
+    """Delete a batch of `user_id`'s follows: of it, with `followers`, or by it."""
+
+    if followers:
+        key, other = Follows.user_being_followed_id, Follows.user_following_id
+    else:
+        key, other = Follows.user_following_id, Follows.user_being_followed_id
+
+    other_ids = [id for (id,) in (db.session
+                                  .query(other)
+                                  .filter(key == user_id)
+                                  .limit(batch_size))]
+    if not other_ids:
+        return 0
+
+    (Follows.query
+        .filter(key == user_id, other.in_(other_ids))
+        .delete(synchronize_session=False))
+    User.recount(other_ids)
+    finish_batch(user_id, len(other_ids))
+
+    session_users.invalidate(*other_ids)
+    if followers:
+        for follower_id in other_ids:
+            timeline_cache.invalidate(follower_id)
+    return len(other_ids)
+
+
+@jobs.task('purge_user')
+def purge_user(user_id, batch_size=None):
+    """Purge a deleted user's rows, a batch at a time (see module docstring)."""
+
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+
+    deletion = Deletion.query.get(user_id)
+    if deletion is None or deletion.finished_at is not None:
+        return
+
+    steps = (
+        lambda: purge_likes(user_id, batch_size),
+        lambda: purge_messages(user_id, batch_size),
+        lambda: purge_follows(user_id, batch_size, followers=True),
+        lambda: purge_follows(user_id, batch_size, followers=False),
+    )
+    for step in steps:
+        while step():
+            pass
+
+    # Nothing refers to the user any more, so this deletes one row.
+    User.query.filter(User.id == user_id).delete(synchronize_session=False)
+    (Deletion.query
+        .filter(Deletion.user_id == user_id)
+        .update({Deletion.rows_deleted: Deletion.rows_deleted + 1,
+                 Deletion.finished_at: datetime.utcnow()},
+                synchronize_session=False))
+    db.session.commit()
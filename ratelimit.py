@@ -0,0 +1,163 @@
+"""Login throttling.
+
+Every login attempt costs a database lookup and a bcrypt check, so
+brute-force traffic is turned away before either happens:
+
+- each client IP gets a token bucket: LOGIN_IP_BURST attempts at once,
+  refilled at LOGIN_IP_PER_MINUTE;
+- each username gets a bucket too, spent only by failed attempts, so
+  guessing one account's password is slow from any number of IPs;
+- usernames that don't exist are remembered for UNKNOWN_USERNAME_TTL
+  seconds and refused without touching the database. Signups and renames
+  forget them here; other processes notice once the TTL passes.
+
+Over the limit, `check()` raises `RateLimited` (a 429 with Retry-After).
+Limits are per process unless a shared backend is passed in. The client
+IP is `request.remote_addr`: behind a proxy, set up ProxyFix first.
+"""
+
+from collections import namedtuple
+from math import ceil
+from threading import Lock
+from time import monotonic
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+from appstate import AppExtension
+from cache import LRUCache
+
+# One app's buckets, and the usernames it found don't exist.
+LimiterState = namedtuple('LimiterState', ['backend', 'unknown'])
+
+
+class RateLimited(TooManyRequests):
+    """Too many login attempts; `retry_after` seconds until the next."""
+
+    description = "Too many login attempts. Please wait a little and try again."
+
+    def __init__(self, retry_after):
+        super().__init__()
+        self.retry_after = retry_after
+
+    def get_headers(self, *args, **kwargs):
+        headers = super().get_headers(*args, **kwargs)
+        headers.append(('Retry-After', str(self.retry_after)))
+        return headers
+
+
+class LocalRateLimitBackend:
+    """In-process token buckets, for the busiest `max_keys` keys.
+
+    This is the stand-in for a shared store; anything with the same
+    methods can be passed to `LoginLimiter` instead.
+    """
+
+    def __init__(self, max_keys=100000):
+        # key -> (tokens, monotonic time they were counted)
+        self._buckets = LRUCache(max_keys)
+        self._lock = Lock()
+
+    def _refill(self, key, per_second, burst, now):
+        tokens, counted = self._buckets.get(key, (burst, now))
+        return min(burst, tokens + (now - counted) * per_second)
+
+    def tokens(self, key, per_second, burst):
+        """Tokens currently in `key`'s bucket."""
+
+        with self._lock:
+            return self._refill(key, per_second, burst, monotonic())
+
+    def take(self, key, per_second, burst):
+        """Spend a token from `key`'s bucket, if it has one.
+
+        Returns 0 on success, otherwise seconds until a token is due.
+        """
+
+        with self._lock:
+            now = monotonic()
+            tokens = self._refill(key, per_second, burst, now)
+            if tokens < 1:
+                return (1 - tokens) / per_second
+            self._buckets.set(key, (tokens - 1, now))
+            return 0
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class LoginLimiter(AppExtension):
+    """Flask extension throttling login attempts (see module docstring)."""
+
+    name = 'login_limiter'
+
+    def __init__(self, app=None, backend=None):
+        super().__init__()
+        # Shared by every app, if given; otherwise each gets a local one.
+        self._backend = backend
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_RATE_LIMIT', True)
+        app.config.setdefault('LOGIN_IP_BURST', 20)
+        app.config.setdefault('LOGIN_IP_PER_MINUTE', 20)
+        app.config.setdefault('LOGIN_USERNAME_BURST', 5)
+        app.config.setdefault('LOGIN_USERNAME_PER_MINUTE', 5)
+        app.config.setdefault('UNKNOWN_USERNAME_TTL', 60)
+
+        self.bind(app, LimiterState(
+            self._backend or LocalRateLimitBackend(),
+            LRUCache(100000, ttl=app.config['UNKNOWN_USERNAME_TTL'])))
+
+    @property
+    def backend(self):
+        return self.state().backend
+
+    @property
+    def unknown(self):
+        return self.state().unknown
+
+    def limits(self, kind):
+        config = self.get_app().config
+        return (config[f'LOGIN_{kind}_PER_MINUTE'] / 60, config[f'LOGIN_{kind}_BURST'])
+
+    def check(self, username):
+        """Admit a login attempt for `username`, or raise `RateLimited`."""
+
+        if not self.get_app().config['LOGIN_RATE_LIMIT']:
+            return
+
+        wait = self.backend.take(('ip', request.remote_addr), *self.limits('IP'))
+        if not wait:
+            per_second, burst = self.limits('USERNAME')
+            tokens = self.backend.tokens(('username', username.lower()), per_second, burst)
+            if tokens < 1:
+                wait = (1 - tokens) / per_second
+        if wait:
+            raise RateLimited(ceil(wait))
+
+    def failed(self, username, unknown=False):
+        """Record a failed attempt; `unknown` if there's no such user.
+
+        An unknown username is remembered for UNKNOWN_USERNAME_TTL from
+        the lookup that found it missing; retrying doesn't extend that.
+        """
+
+        if not self.get_app().config['LOGIN_RATE_LIMIT']:
+            return
+
+        self.backend.take(('username', username.lower()), *self.limits('USERNAME'))
+        if unknown and not self.is_unknown(username):
+            self.unknown.set(username, True)
+
+    def is_unknown(self, username):
+        """Whether `username` recently turned out not to exist."""
+
+        return self.unknown.get(username, False)
+
+    def forget_unknown(self, username):
+        """`username` exists now (signup or rename)."""
+
+        self.unknown.pop(username)
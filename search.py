@@ -0,0 +1,214 @@
+"""Search for Warbler."""
+
+import re
+from collections import Counter, defaultdict, namedtuple
+from threading import Lock
+
+from sqlalchemy import case, func, or_, text
+
+from models import db, User, Message
+
+USERS_PER_PAGE = 30
+MESSAGES_PER_PAGE = 30
+
+# Deep pages of ranked results get expensive to skip to and nobody reads
+# them; clamp requests for later pages to this one.
+MAX_PAGE = 50
+
+SearchPage = namedtuple('SearchPage', ['items', 'page', 'has_next'])
+
+
+def is_postgres():
+    """Is the app's database PostgreSQL (vs. the SQLite used in tests)?"""
+
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def escape_like(text):
+    """Escape `text` so LIKE treats its % and _ literally (escape char: \\)."""
+
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def clamp_page(page):
+    """Page number within 1..MAX_PAGE."""
+
+    return min(max(page or 1, 1), MAX_PAGE)
+
+
+def search_page(items, page, has_next):
+    """A `SearchPage`; there's no next page after MAX_PAGE."""
+
+    return SearchPage(items, page, has_next and page < MAX_PAGE)
+
+
+def fetch_page(query, page, per_page):
+    """Run `query` for one page, fetching an extra row to spot a next page."""
+
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return search_page(rows[:per_page], page, len(rows) > per_page)
+
+
+def search_users(q, page=1, per_page=USERS_PER_PAGE):
+    """Users matching `q` in their username, bio or location, best first.
+
+    Usernames starting with `q` rank first, then other username matches,
+    then bio/location matches. On PostgreSQL matches are found through the
+    trigram indexes on users, and usernames that are merely similar to `q`
+    (typos) also match, ranked by similarity. An empty `q` lists everyone.
+    """
+
+    page = clamp_page(page)
+    q = (q or '').strip()
+
+    users = User.query.filter(User.deleted_at.is_(None))
+
+    if not q:
+        return fetch_page(users.order_by(User.id), page, per_page)
+
+    prefix = escape_like(q) + '%'
+    contains = '%' + escape_like(q) + '%'
+
+    username_starts = User.username.ilike(prefix, escape='\\')
+    username_contains = User.username.ilike(contains, escape='\\')
+
+    matches = [username_contains,
+               User.bio.ilike(contains, escape='\\'),
+               User.location.ilike(contains, escape='\\')]
+    rank = case([(username_starts, 2), (username_contains, 1)], else_=0)
+
+    if is_postgres():
+        # pg_trgm's similarity operator; written as text() so the driver's
+        # paramstyle escaping of the % is taken care of.
+        matches.append(text("users.username % :similar_to").bindparams(similar_to=q))
+        rank = rank + func.similarity(User.username, q)
+
+    query = (users
+             .filter(or_(*matches))
+             .order_by(rank.desc(), User.username))
+
+    return fetch_page(query, page, per_page)
+
+
+def search_messages(q, page=1, per_page=MESSAGES_PER_PAGE):
+    """Messages containing every word of `q`, most relevant first.
+
+    On PostgreSQL this is a full-text query against the GIN-indexed
+    `search_vector` column, ranked with ts_rank (so stemming applies:
+    "birds" finds "bird"). Elsewhere it uses the in-process
+    `message_index`. Either way the page's authors are loaded with it.
+    """
+
+    page = clamp_page(page)
+    q = (q or '').strip()
+
+    if not q:
+        return SearchPage([], page, False)
+
+    if is_postgres():
+        tsquery = func.plainto_tsquery('english', q)
+        query = (Message
+                 .with_authors()
+                 .filter(Message.search_vector.op('@@')(tsquery))
+                 .order_by(func.ts_rank(Message.search_vector, tsquery).desc(),
+                           Message.timestamp.desc()))
+        return fetch_page(query, page, per_page)
+
+    ids = message_index.search(q)
+    start = (page - 1) * per_page
+    return search_page(Message.get_many(ids[start:start + per_page]),
+                       page,
+                       len(ids) > start + per_page)
+
+
+def tokenize(text):
+    """Lower-cased words in `text`."""
+
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+class MessageIndex:
+    """In-process inverted index over message text.
+
+    Used for message search when the database isn't PostgreSQL (local runs
+    and tests). Built from the messages table on first use, then kept
+    current by `add()` / `remove()` as messages are written and deleted.
+    It lives in this process only.
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(dict)      # word -> {message id: count}
+        self._words = {}                        # message id -> its words
+        self._built = False
+        self._lock = Lock()
+
+    def _build(self):
+        for id, text in db.session.query(Message.id, Message.text).yield_per(1000):
+            self._add(id, text)
+        self._built = True
+
+    def _add(self, id, text):
+        counts = Counter(tokenize(text))
+        for word, count in counts.items():
+            self._postings[word][id] = count
+        self._words[id] = list(counts)
+
+    def add(self, id, text):
+        """Index a new message (no-op until the index is first built)."""
+
+        with self._lock:
+            if self._built:
+                self._add(id, text)
+
+    def remove(self, id):
+        """Drop a deleted message from the index."""
+
+        with self._lock:
+            for word in self._words.pop(id, ()):
+                self._postings[word].pop(id, None)
+
+    def clear(self):
+        """Forget everything; the next search rebuilds from the database."""
+
+        with self._lock:
+            self._postings.clear()
+            self._words.clear()
+            self._built = False
+
+    def search(self, q):
+        """Ids of messages containing every word of `q`, best match first.
+
+        Ranked by how often the words occur, newest (highest id) first
+        among equals.
+        """
+
+        words = set(tokenize(q))
+        if not words:
+            return []
+
+        with self._lock:
+            if not self._built:
+                self._build()
+
+            postings = sorted((self._postings.get(word, {}) for word in words), key=len)
+            ids = set(postings[0]).intersection(*postings[1:])
+            scores = {id: sum(p[id] for p in postings) for id in ids}
+
+        return sorted(ids, key=lambda id: (-scores[id], -id))
+
+
+message_index = MessageIndex()
+
+
+def index_message(message):
+    """Keep the fallback index current after inserting `message`."""
+
+    if not is_postgres():
+        message_index.add(message.id, message.text)
+
+
+def unindex_message(message_id):
+    """Keep the fallback index current after deleting a message."""
+
+    if not is_postgres():
+        message_index.remove(message_id)
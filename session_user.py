@@ -0,0 +1,116 @@
+"""Cheap loading of the logged-in user for each request."""
+
+from collections import namedtuple
+
+from appstate import AppExtension
+from cache import LRUCache
+from models import db, User, Follows
+
+# Everything pages need about the logged-in user: the navbar, the sidebar
+# card, ownership checks and page ETags. Notably not the password hash or bio.
+SNAPSHOT_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.messages_count,
+    User.following_count,
+    User.followers_count,
+    User.likes_count,
+    User.profile_version,
+    User.updated_at,
+)
+
+UserSnapshot = namedtuple('UserSnapshot', [column.key for column in SNAPSHOT_COLUMNS])
+
+
+class CurrentUser:
+    """The logged-in user, as seen by one request (this is `g.user`).
+
+    Reads its attributes from a shared, immutable `UserSnapshot`; follow
+    state is loaded on demand and kept only for this request. It is not a
+    `User` row: views that change the user load one with `load()`.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._following_ids = None
+
+    def __getattr__(self, name):
+        return getattr(self._snapshot, name)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def load(self):
+        """The full `User` row for this user."""
+
+        return User.query.get(self.id)
+
+    def following_ids(self):
+        """Set of ids of the users this user follows (one query, once)."""
+
+        if self._following_ids is None:
+            self._following_ids = Follows.followed_ids(self.id)
+        return self._following_ids
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return other_user.id in self.following_ids()
+
+
+class SessionUserLoader(AppExtension):
+    """Loads `CurrentUser`s, caching snapshots for SESSION_USER_TTL seconds.
+
+    A cache hit costs no query at all. Views that change what's in a
+    snapshot (profile edits, counters) call `invalidate()` after
+    committing; anything they miss is at most SESSION_USER_TTL stale.
+    """
+
+    name = 'session_users'
+
+    def __init__(self, app=None):
+        super().__init__()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_USER_TTL', 5)
+        app.config.setdefault('SESSION_USER_CACHE_SIZE', 10000)
+
+        self.bind(app, LRUCache(app.config['SESSION_USER_CACHE_SIZE'],
+                                ttl=app.config['SESSION_USER_TTL']))
+
+    def load(self, user_id):
+        """`CurrentUser` for `user_id`, or None if there's no such user
+        (or it was deleted)."""
+
+        snapshots = self.state()
+        snapshot = snapshots.get(user_id)
+
+        if snapshot is None:
+            row = (db.session
+                   .query(*SNAPSHOT_COLUMNS)
+                   .filter(User.id == user_id, User.deleted_at.is_(None))
+                   .first())
+            if row is None:
+                return None
+            snapshot = UserSnapshot(*row)
+            snapshots.set(user_id, snapshot)
+
+        return CurrentUser(snapshot)
+
+    def invalidate(self, *user_ids):
+        """Forget cached snapshots for `user_ids`."""
+
+        snapshots = self.state()
+        for user_id in user_ids:
+            snapshots.pop(user_id)
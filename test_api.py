@@ -0,0 +1,163 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Likes, Follows
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, session_users
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+XHR = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+class APITestCase(TestCase):
+    """Test /api/v1."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser1",
+                           email="test1@test.com",
+                           password="testuser1",
+                           image_url=None)
+        other = User.signup(username="testuser2",
+                            email="test2@test.com",
+                            password="testuser2",
+                            image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+        self.other_id = other.id
+
+        msg = Message(text="Hello API", user_id=self.other_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        session_users.invalidate(self.user_id, self.other_id)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def log_in(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_login_required(self):
+        """Anonymous requests get a JSON 401"""
+
+        resp = self.client.get('/api/v1/timeline')
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn('error', resp.get_json())
+
+    def test_not_found(self):
+        """Missing things are a JSON 404"""
+        with self.client as c:
+            self.log_in(c)
+            resp = c.get('/api/v1/users/99999')
+            self.assertEqual(resp.status_code, 404)
+            self.assertIn('error', resp.get_json())
+
+    def test_user_messages(self):
+        """A user's messages, with the author and like state"""
+        with self.client as c:
+            self.log_in(c)
+            resp = c.get(f'/api/v1/users/{self.other_id}/messages')
+
+            data = resp.get_json()
+            self.assertEqual(resp.status_code, 200)
+            self.assertIsNone(data['next_cursor'])
+            self.assertEqual(len(data['messages']), 1)
+
+            msg = data['messages'][0]
+            self.assertEqual(msg['text'], 'Hello API')
+            self.assertEqual(msg['user']['username'], 'testuser2')
+            self.assertFalse(msg['liked'])
+            self.assertNotIn('email', msg['user'])
+
+    def test_user_detail(self):
+        """A profile leaves out private fields"""
+        with self.client as c:
+            self.log_in(c)
+            data = c.get(f'/api/v1/users/{self.other_id}').get_json()
+
+            self.assertEqual(data['user']['username'], 'testuser2')
+            self.assertNotIn('email', data['user'])
+            self.assertNotIn('password', data['user'])
+            self.assertFalse(data['following'])
+
+    def test_follow_and_timeline(self):
+        """Following puts a user's messages on the timeline"""
+        with self.client as c:
+            self.log_in(c)
+            self.assertEqual(c.get('/api/v1/timeline').get_json()['messages'], [])
+
+            resp = c.post(f'/api/v1/users/{self.other_id}/follow', headers=XHR)
+            self.assertEqual(resp.get_json(), {'user_id': self.other_id, 'following': True,
+                                               'followers_count': 1})
+
+            messages = c.get('/api/v1/timeline').get_json()['messages']
+            self.assertEqual([m['id'] for m in messages], [self.msg_id])
+
+            resp = c.delete(f'/api/v1/users/{self.other_id}/follow', headers=XHR)
+            self.assertFalse(resp.get_json()['following'])
+            self.assertEqual(resp.get_json()['followers_count'], 0)
+
+    def test_like_toggle(self):
+        """One POST likes, the next unlikes"""
+        with self.client as c:
+            self.log_in(c)
+
+            resp = c.post(f'/api/v1/messages/{self.msg_id}/like', headers=XHR)
+            self.assertEqual(resp.get_json(), {'message_id': self.msg_id, 'liked': True,
+                                               'like_count': 1})
+            self.assertEqual(Likes.query.filter_by(user_id=self.user_id).count(), 1)
+
+            resp = c.post(f'/api/v1/messages/{self.msg_id}/like', headers=XHR)
+            self.assertFalse(resp.get_json()['liked'])
+            self.assertEqual(resp.get_json()['like_count'], 0)
+            self.assertEqual(Likes.query.filter_by(user_id=self.user_id).count(), 0)
+
+    def test_like_set_is_idempotent(self):
+        """PUT and DELETE can be repeated without toggling back"""
+        with self.client as c:
+            self.log_in(c)
+
+            for _ in range(2):
+                resp = c.put(f'/api/v1/messages/{self.msg_id}/like', headers=XHR)
+                self.assertTrue(resp.get_json()['liked'])
+            self.assertEqual(Likes.query.filter_by(user_id=self.user_id).count(), 1)
+            self.assertEqual(User.query.get(self.user_id).likes_count, 1)
+
+            for _ in range(2):
+                resp = c.delete(f'/api/v1/messages/{self.msg_id}/like', headers=XHR)
+                self.assertFalse(resp.get_json()['liked'])
+            self.assertEqual(Likes.query.filter_by(user_id=self.user_id).count(), 0)
+            self.assertEqual(User.query.get(self.user_id).likes_count, 0)
+
+    def test_writes_need_header(self):
+        """Writes without X-Requested-With are refused"""
+        with self.client as c:
+            self.log_in(c)
+            resp = c.post(f'/api/v1/messages/{self.msg_id}/like')
+            self.assertEqual(resp.status_code, 403)
+            self.assertEqual(Likes.query.count(), 0)
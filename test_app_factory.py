@@ -0,0 +1,86 @@
+"""App factory and configuration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_app_factory.py
+
+
+import os
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy.engine.url import make_url
+
+from models import db, PooledSQLAlchemy
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, create_app, views
+from extensions import jobs, session_users
+from config import ProdConfig, TestConfig
+
+
+class AppFactoryTestCase(TestCase):
+    """Test create_app()'s pieces without building a second live app."""
+
+    def make_app(self, config):
+        flask_app = Flask(__name__)
+        flask_app.config.from_object(config)
+        return flask_app
+
+    def test_views_keep_endpoint_names(self):
+        flask_app = Flask(__name__)
+        views.register(flask_app)
+
+        self.assertIn('login', flask_app.view_functions)
+        self.assertIn('homepage', flask_app.view_functions)
+        self.assertEqual(set(flask_app.view_functions),
+                         {endpoint for endpoint in app.view_functions
+                          if not endpoint.startswith('metrics') and not endpoint.startswith('api.')})
+
+    def test_prod_pool_options(self):
+        flask_app = self.make_app(ProdConfig)
+        sa = PooledSQLAlchemy()
+        sa.init_app(flask_app)
+
+        options = {}
+        sa.apply_driver_hacks(flask_app, make_url('postgresql:///warbler'), options)
+
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['pool_size'], ProdConfig.SQLALCHEMY_ENGINE_OPTIONS['pool_size'])
+        self.assertIn('pool_recycle', options)
+        self.assertIn('max_overflow', options)
+
+    def test_sqlite_gets_no_pool_options(self):
+        flask_app = self.make_app(ProdConfig)
+        flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        sa = PooledSQLAlchemy()
+        sa.init_app(flask_app)
+
+        options = {}
+        sa.apply_driver_hacks(flask_app, make_url('sqlite://'), options)
+
+        self.assertNotIn('pool_pre_ping', options)
+        self.assertNotIn('max_overflow', options)
+
+    def test_apps_keep_their_own_state(self):
+        """A second app gets its own extension state, and leaves the first's alone"""
+
+        other = create_app('test')
+        # connect_db() pointed `db` at the new app.
+        db.app = app
+
+        self.assertIsNot(other.extensions['jobs'], app.extensions['jobs'])
+        with other.app_context():
+            self.assertIs(session_users.state(), other.extensions['session_users'])
+        with app.app_context():
+            self.assertIs(jobs.state(), app.extensions['jobs'])
+        self.assertIs(session_users.state(), app.extensions['session_users'])
+
+    def test_profiles(self):
+        self.assertFalse(ProdConfig.DEBUG_TOOLBAR)
+        self.assertFalse(TestConfig.DEBUG_TOOLBAR)
+        self.assertEqual(TestConfig.SESSION_USER_TTL, 0)
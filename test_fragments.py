@@ -0,0 +1,94 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Likes
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, fragment_cache, session_users
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test cached rendering of message list items."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+        Likes.query.delete()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser1",
+                           email="test1@test.com",
+                           password="testuser1",
+                           image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+
+        msg = Message(text="Fragment", user_id=self.user_id)
+        db.session.add(msg)
+        User.adjust_counts(self.user_id, messages_count=1)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        fragment_cache.clear()
+        session_users.invalidate(self.user_id)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_item_cached(self):
+        """A rendered item is reused for the same author version"""
+
+        msg = Message.query.get(self.msg_id)
+        with app.app_context():
+            first = fragment_cache.message_item(msg, False)
+            self.assertIn('Fragment', first)
+            self.assertIs(fragment_cache.message_item(msg, False), first)
+
+            liked = fragment_cache.message_item(msg, True)
+            self.assertIsNot(liked, first)
+            self.assertIn('btn-primary', liked)
+
+    def test_profile_edit_invalidates(self):
+        """A new username shows up in already cached items"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get(f'/users/{self.user_id}')
+            self.assertIn(b'@testuser1', resp.data)
+
+            User.query.filter_by(id=self.user_id).update({'username': 'renamed'})
+            db.session.commit()
+
+            resp = c.get(f'/users/{self.user_id}')
+            self.assertIn(b'@renamed', resp.data)
+            self.assertNotIn(b'@testuser1', resp.data)
+
+    def test_delete_forgets(self):
+        """Deleting a message drops its cached items"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.get('/')
+            self.assertIsNotNone(fragment_cache.state().get(self.msg_id))
+
+            c.post(f'/messages/{self.msg_id}/delete')
+            self.assertIsNone(fragment_cache.state().get(self.msg_id))
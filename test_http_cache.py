@@ -0,0 +1,171 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+from unittest import TestCase
+from flask import url_for
+import actions
+from models import db, User, Message, Likes, Follows
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, session_users
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HTTPCacheTestCase(TestCase):
+    """Test static caching and conditional page requests."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser1",
+                           email="test1@test.com",
+                           password="testuser1",
+                           image_url=None)
+        other = User.signup(username="testuser2",
+                            email="test2@test.com",
+                            password="testuser2",
+                            image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+        self.other_id = other.id
+
+        msg = Message(text="Cache me", user_id=self.other_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        session_users.invalidate(self.user_id, self.other_id)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def log_in(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_versioned_static_is_immutable(self):
+        """Static URLs from url_for carry a version and are cached for good"""
+
+        with app.test_request_context():
+            url = url_for('static', filename='stylesheets/style.css')
+        self.assertIn('?v=', url)
+
+        resp = self.client.get(url)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+
+        resp = self.client.get('/static/stylesheets/style.css')
+        self.assertNotIn('immutable', resp.headers['Cache-Control'])
+
+    def test_uncached_pages_stay_uncached(self):
+        """Pages without validators still forbid caching"""
+        with self.client as c:
+            self.log_in(c)
+            resp = c.get('/')
+            self.assertIn('no-store', resp.headers['Cache-Control'])
+
+    def test_profile_not_modified(self):
+        """A profile answers a matching If-None-Match with 304"""
+        with self.client as c:
+            self.log_in(c)
+
+            resp = c.get(f'/users/{self.other_id}')
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+            resp = c.get(f'/users/{self.other_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+
+    def test_profile_like_changes_etag(self):
+        """Someone else liking a message on the profile gives it a new ETag"""
+        with self.client as c:
+            self.log_in(c)
+            resp = c.get(f'/users/{self.other_id}')
+            etag = resp.headers['ETag']
+            self.assertNotIn('Last-Modified', resp.headers)
+
+            actions.toggle_like(self.other_id, self.msg_id)
+
+            resp = c.get(f'/users/{self.other_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_profile_changes_etag(self):
+        """A new message on the profile gives it a new ETag"""
+        with self.client as c:
+            self.log_in(c)
+            etag = c.get(f'/users/{self.other_id}').headers['ETag']
+
+            db.session.add(Message(text="Another", user_id=self.other_id))
+            User.adjust_counts(self.other_id, messages_count=1)
+            db.session.commit()
+
+            resp = c.get(f'/users/{self.other_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b'Another', resp.data)
+
+    def test_viewer_follow_changes_etag(self):
+        """Following the author changes the message page's ETag"""
+        with self.client as c:
+            self.log_in(c)
+            etag = c.get(f'/messages/{self.msg_id}').headers['ETag']
+
+            resp = c.get(f'/messages/{self.msg_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            c.post(f'/users/follow/{self.other_id}')
+
+            resp = c.get(f'/messages/{self.msg_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b'Unfollow', resp.data)
+
+    def test_followers_not_modified(self):
+        """The followers page changes when a follower edits their card"""
+        with self.client as c:
+            self.log_in(c)
+            c.post(f'/users/follow/{self.other_id}')
+
+            etag = c.get(f'/users/{self.other_id}/followers').headers['ETag']
+            resp = c.get(f'/users/{self.other_id}/followers', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            User.query.filter_by(id=self.user_id).update({'username': 'renamed'})
+            db.session.commit()
+            session_users.invalidate(self.user_id)
+
+            resp = c.get(f'/users/{self.other_id}/followers', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b'renamed', resp.data)
+
+    def test_no_304_with_pending_flash(self):
+        """Flash messages are never swallowed by a 304"""
+        with self.client as c:
+            self.log_in(c)
+            etag = c.get(f'/users/{self.other_id}').headers['ETag']
+
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', 'Hello!')]
+
+            resp = c.get(f'/users/{self.other_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b'Hello!', resp.data)
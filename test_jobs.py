@@ -0,0 +1,150 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, Job
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, jobs
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+calls = []
+locks = []
+
+
+@jobs.task('test_record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('test_heartbeat')
+def beat():
+    jobs.heartbeat()
+    db.session.commit()
+    locks.append(Job.query.filter_by(task='test_heartbeat').one().locked_at)
+
+
+@jobs.task('test_fail')
+def fail():
+    raise ValueError("nope")
+
+
+class JobQueueTestCase(TestCase):
+    """Test queueing, running and retrying jobs."""
+
+    def setUp(self):
+        """Empty the queue."""
+
+        db.create_all()
+        Job.query.delete()
+        db.session.commit()
+        calls.clear()
+        locks.clear()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def test_run_pending(self):
+        """Queued jobs run once, in order, with their arguments"""
+
+        jobs.enqueue('test_record', 1)
+        jobs.enqueue('test_record', 2)
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual({job.status for job in Job.query}, {Job.DONE})
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_idempotency_key(self):
+        """A second job with the same key is dropped"""
+
+        self.assertTrue(jobs.enqueue('test_record', 1, key='once'))
+        self.assertFalse(jobs.enqueue('test_record', 1, key='once'))
+        db.session.commit()
+
+        jobs.run_pending()
+        self.assertEqual(calls, [1])
+
+    def test_unknown_task(self):
+        """Enqueueing a task nobody registered fails straight away"""
+
+        with self.assertRaises(LookupError):
+            jobs.enqueue('no_such_task')
+
+    def test_retry_then_fail(self):
+        """A failing job is retried later, then given up on"""
+
+        jobs.enqueue('test_fail')
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn('nope', job.last_error)
+
+        Job.query.update({Job.attempts: app.config['JOBS_MAX_ATTEMPTS'] - 1,
+                          Job.run_at: datetime.utcnow()})
+        db.session.commit()
+
+        jobs.run_pending()
+        self.assertEqual(Job.query.one().status, Job.FAILED)
+
+    def test_stale_job_reclaimed(self):
+        """A job left running by a dead worker runs again"""
+
+        jobs.enqueue('test_record', 1)
+        db.session.commit()
+        Job.query.update({Job.status: Job.RUNNING,
+                          Job.locked_at: datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(calls, [1])
+
+    def test_heartbeat(self):
+        """A running job can renew its lock"""
+
+        jobs.enqueue('test_heartbeat')
+        db.session.commit()
+        job = jobs.claim()
+        claimed = datetime.utcnow() - timedelta(days=1)
+        Job.query.update({Job.locked_at: claimed})
+        db.session.commit()
+
+        jobs.run(job)
+        self.assertGreater(locks[0], claimed + timedelta(hours=1))
+
+    def test_prune(self):
+        """Finished jobs are deleted once they're old enough"""
+
+        jobs.enqueue('test_record', 1, key='old')
+        jobs.enqueue('test_record', 2, key='new')
+        jobs.enqueue('test_fail', key='failed')
+        db.session.commit()
+        Job.query.update({Job.status: Job.DONE,
+                          Job.finished_at: datetime.utcnow() - timedelta(days=2)})
+        Job.query.filter_by(key='new').update({Job.finished_at: datetime.utcnow()})
+        Job.query.filter_by(key='failed').update({Job.status: Job.FAILED})
+        db.session.commit()
+
+        self.assertEqual(jobs.prune(), 1)
+        self.assertEqual({job.key for job in Job.query}, {'new', 'failed'})
+        # The key is free again.
+        self.assertTrue(jobs.enqueue('test_record', 1, key='old'))
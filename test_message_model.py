@@ -2,10 +2,12 @@
 
 import os
 from unittest import TestCase
-from models import db, connect_db, Message, User
+import actions
+from models import db, connect_db, Message, User, Likes
 
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
 
 
 from app import app, CURR_USER_KEY
@@ -57,6 +59,72 @@ class MessageModelTests(TestCase):
             
             
             
+    def test_get_many(self):
+        """Tests if messages load by id list in order, skipping missing ids"""
+        with self.client:
+            
+            first = Message(text='first', user_id=self.testuser.id)
+            second = Message(text='second', user_id=self.testuser.id)
+            db.session.add_all([first, second])
+            db.session.commit()
+
+            messages = Message.get_many([second.id, 999, first.id])
+
+            self.assertEqual([m.text for m in messages], ['second', 'first'])
+            self.assertEqual(messages[0].user.username, 'testuser')
+            self.assertEqual(Message.get_many([]), [])
+            
+            
+    def test_likes_by_many_users(self):
+        """Tests if several users can like the same message, once each"""
+        with self.client:
+            
+            other = User.signup(username='other', email='other@test.com',
+                                password='password', image_url=None)
+            message = Message(text='Popular', user_id=self.testuser.id)
+            db.session.add(message)
+            db.session.commit()
+
+            self.assertEqual(Likes.toggle(self.testuser.id, message.id), (True, 1))
+            self.assertEqual(Likes.toggle(other.id, message.id), (True, 1))
+            db.session.commit()
+            self.assertEqual(Likes.query.filter_by(message_id=message.id).count(), 2)
+
+            self.assertEqual(Likes.toggle(other.id, message.id), (False, -1))
+            self.assertEqual(Likes.like(self.testuser.id, message.id), 0)
+            self.assertEqual(Likes.unlike(other.id, message.id), 0)
+            db.session.commit()
+            self.assertEqual(Likes.query.filter_by(message_id=message.id).count(), 1)
+            
+            
+    def test_like_count(self):
+        """Tests if like counts follow toggles and can be rebuilt"""
+        with self.client:
+            
+            other = User.signup(username='other', email='other@test.com',
+                                password='password', image_url=None)
+            message = Message(text='Popular', user_id=self.testuser.id)
+            db.session.add(message)
+            db.session.commit()
+            message_id = message.id
+            self.assertEqual(message.like_count, 0)
+
+            actions.toggle_like(self.testuser.id, message_id)
+            actions.toggle_like(other.id, message_id)
+            self.assertEqual(Message.query.get(message_id).like_count, 2)
+
+            actions.toggle_like(other.id, message_id)
+            self.assertEqual(Message.query.get(message_id).like_count, 1)
+            self.assertEqual(Message.query.get(message_id).serialize()['like_count'], 1)
+
+            Message.adjust_like_count(message_id, 10)
+            Message.recount([message_id])
+            db.session.commit()
+            self.assertEqual(Message.query.get(message_id).like_count, 1)
+            
+            
+            
+            
     def tearDown(self):
         """Clean up any fouled transaction."""
         db.session.rollback()
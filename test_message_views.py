@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 from flask import url_for,g
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Likes, Job
 
 
 # BEFORE we import our app, let's set an environmental variable
@@ -17,6 +17,7 @@ from models import db, connect_db, Message, User
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
 
 
 # Now we can import app
@@ -55,6 +56,8 @@ class MessageViewTestCase(TestCase):
         # with app.app_context():
         #     db.create_all()
         
+        Likes.query.delete()
+        Job.query.delete()
         User.query.delete()
         Message.query.delete()
 
@@ -99,6 +102,47 @@ class MessageViewTestCase(TestCase):
       
       
       
+    def test_message_counter(self):
+        """Do adding and deleting messages keep the author's count in step?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1.id
+            user_id = self.testuser1.id
+
+            c.post("/messages/new", data={"text": "Hello"})
+            self.assertEqual(User.query.get(user_id).messages_count, 1)
+
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(User.query.get(user_id).messages_count, 0)
+      
+      
+      
+    def test_delete_recounts_likers(self):
+        """Deleting a liked message fixes its likers' counts in the background"""
+
+        liker_id = self.testuser2.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1.id
+
+            c.post("/messages/new", data={"text": "Hello"})
+            msg = Message.query.one()
+            db.session.add(Likes(user_id=liker_id, message_id=msg.id))
+            User.recount([liker_id])
+            db.session.commit()
+
+            c.post(f"/messages/{msg.id}/delete")
+
+            self.assertEqual(User.query.get(liker_id).likes_count, 0)
+            self.assertEqual(Likes.query.count(), 0)
+            job = Job.query.filter_by(task='recount_users').one()
+            self.assertEqual(job.status, Job.DONE)
+      
+      
+      
     def test_prohibit_delete_anoter_user_message(self):
         """Test if a user is prohibited to delete another user's message"""
         
@@ -0,0 +1,106 @@
+"""Instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, query_metrics
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryMetricsTestCase(TestCase):
+    """Test per-request query counting."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(username='user1', email='test1@example.com', password='password1')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        query_metrics.reset()
+
+    def test_server_timing_header(self):
+        """Responses report DB time and query count"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            response = c.get('/')
+
+            self.assertIn('Server-Timing', response.headers)
+            self.assertRegex(response.headers['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_metrics_endpoint(self):
+        """/metrics reports totals per endpoint"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.get('/')
+            c.get('/')
+
+            response = c.get('/metrics')
+            text = response.data.decode()
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('warbler_requests_total{endpoint="homepage"} 2', text)
+            self.assertIn('# TYPE warbler_db_queries_total counter', text)
+
+    def test_slowest_statements(self):
+        """/metrics/slowest shows statements in debug mode only"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.get('/')
+
+            self.assertEqual(c.get('/metrics/slowest').status_code, 404)
+
+            app.debug = True
+            try:
+                response = c.get('/metrics/slowest')
+            finally:
+                app.debug = False
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('homepage', response.data.decode())
+            self.assertIn('SELECT', response.data.decode())
+
+    def test_slow_request_logged(self):
+        """Requests over the query threshold are logged"""
+
+        app.config['SLOW_REQUEST_QUERIES'] = 0
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user_id
+
+                with self.assertLogs(app.logger, 'WARNING') as logs:
+                    c.get('/')
+
+            self.assertIn('Slow request GET /', logs.output[0])
+        finally:
+            app.config['SLOW_REQUEST_QUERIES'] = 50
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
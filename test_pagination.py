@@ -0,0 +1,206 @@
+"""Pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+from models import db, User, Message, Likes, Follows
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY
+from pagination import encode_cursor, decode_cursor, paginate, paginate_follows
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PaginationTestCase(TestCase):
+    """Test keyset pagination of message lists."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(username='user1', email='test1@example.com', password='password1')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        # Every message shares a timestamp, so ordering falls back on id.
+        now = datetime.utcnow()
+        db.session.add_all([Message(text=f'warble {i}', user_id=user.id, timestamp=now)
+                            for i in range(5)])
+        db.session.commit()
+
+    def test_cursor_round_trip(self):
+        """A cursor decodes back to its message's position"""
+
+        msg = Message.query.first()
+
+        self.assertEqual(decode_cursor(encode_cursor(msg)), (msg.timestamp, msg.id))
+
+    def test_invalid_cursor(self):
+        """Garbage cursors are ignored"""
+
+        self.assertIsNone(decode_cursor('not a cursor'))
+        self.assertIsNone(decode_cursor(''))
+
+    def test_paginate_through_ties(self):
+        """Pages don't skip or repeat messages with equal timestamps"""
+
+        query = Message.query.filter(Message.user_id == self.user_id)
+        seen = []
+        page = paginate(query, per_page=2)
+        seen.extend(m.text for m in page.items)
+        while page.next_cursor:
+            page = paginate(query, page.next_cursor, per_page=2)
+            seen.extend(m.text for m in page.items)
+
+        self.assertEqual(seen, [f'warble {i}' for i in reversed(range(5))])
+
+    def test_paginate_liked_by(self):
+        """Likes are joined in without repeating or dropping messages"""
+
+        other = User(username='user2', email='test2@example.com', password='password2')
+        db.session.add(other)
+        db.session.commit()
+
+        liked = Message.query.filter_by(text='warble 3').one()
+        db.session.add_all([Likes(user_id=self.user_id, message_id=liked.id),
+                            Likes(user_id=other.id, message_id=liked.id)])
+        db.session.commit()
+
+        query = Message.query.filter(Message.user_id == self.user_id)
+        page = paginate(query, per_page=2, liked_by=self.user_id)
+        self.assertEqual([m.text for m in page.items], ['warble 4', 'warble 3'])
+        self.assertEqual(page.liked_ids, {liked.id})
+
+        page = paginate(query, page.next_cursor, per_page=2, liked_by=other.id)
+        self.assertEqual([m.text for m in page.items], ['warble 2', 'warble 1'])
+        self.assertEqual(page.liked_ids, set())
+        self.assertIsNone(paginate(query).liked_ids)
+
+    def test_profile_older_link(self):
+        """Profile pages link to older messages when there are more"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            first = Message.query.order_by(Message.id.desc()).first()
+            response = c.get(f'/users/{self.user_id}?before={encode_cursor(first)}')
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(b'warble 4', response.data)
+            self.assertIn(b'warble 3', response.data)
+
+    def test_liked_messages_page(self):
+        """Liked messages page lists liked messages"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            msg = Message.query.filter_by(text='warble 2').one()
+            db.session.add(Likes(user_id=self.user_id, message_id=msg.id))
+            db.session.commit()
+
+            response = c.get('/users/likes')
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'warble 2', response.data)
+            self.assertNotIn(b'warble 3', response.data)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
+
+
+class FollowsPaginationTestCase(TestCase):
+    """Test keyset pagination of following and follower lists."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        Follows.query.delete()
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        users = [User(username=f'user{i}', email=f'test{i}@example.com', password='password')
+                 for i in range(6)]
+        db.session.add_all(users)
+        db.session.commit()
+        self.user_id = users[0].id
+        self.other_ids = [u.id for u in users[1:]]
+
+        # Everyone else follows user0; user0 follows the first two back.
+        db.session.add_all([Follows(user_being_followed_id=self.user_id, user_following_id=id)
+                            for id in self.other_ids])
+        db.session.add_all([Follows(user_being_followed_id=id, user_following_id=self.user_id)
+                            for id in self.other_ids[:2]])
+        db.session.commit()
+
+    def test_paginate_followers(self):
+        """Pages of followers cover everyone once, in id order"""
+
+        seen = []
+        page = paginate_follows(self.user_id, followers=True, per_page=2)
+        seen.extend(u.id for u in page.items)
+        while page.next_cursor:
+            page = paginate_follows(self.user_id, followers=True,
+                                    after=page.next_cursor, per_page=2)
+            seen.extend(u.id for u in page.items)
+
+        self.assertEqual(seen, sorted(self.other_ids))
+
+    def test_paginate_following(self):
+        """Following pages list the followed users"""
+
+        page = paginate_follows(self.user_id, per_page=2)
+
+        self.assertEqual([u.id for u in page.items], sorted(self.other_ids[:2]))
+        self.assertIsNone(page.next_cursor)
+
+    def test_followed_among(self):
+        """Follow state for a page of users comes from one batch lookup"""
+
+        self.assertEqual(Follows.followed_among(self.user_id, self.other_ids),
+                         set(self.other_ids[:2]))
+        self.assertEqual(Follows.followed_among(self.user_id, []), set())
+
+    def test_followers_page(self):
+        """The followers page shows follow buttons and honors its cursor"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            response = c.get(f'/users/{self.user_id}/followers')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data.count(b'Unfollow'), 2)
+
+            after = sorted(self.other_ids)[-2]
+            response = c.get(f'/users/{self.user_id}/followers?after={after}')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'@user5', response.data)
+            self.assertNotIn(b'@user4', response.data)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
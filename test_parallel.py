@@ -0,0 +1,117 @@
+"""Concurrent query tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_parallel.py
+
+
+import os
+from threading import Thread
+from unittest import TestCase
+from werkzeug.exceptions import NotFound
+from models import db, User, Message, Likes
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY
+from pagination import Page
+from parallel import attach, gather
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ParallelTestCase(TestCase):
+    """Test gather() and merging results into the request's session."""
+
+    def setUp(self):
+        """Add sample data."""
+
+        db.create_all()
+
+        Likes.query.delete()
+        User.query.delete()
+        Message.query.delete()
+
+        user = User(username='user1', email='test1@example.com', password='password1')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        db.session.add(Message(text='warble', user_id=self.user_id))
+        db.session.commit()
+
+        self.ctx = app.test_request_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def test_gather_keeps_order(self):
+        """Results come back in the order the calls were given"""
+
+        user, count = gather(lambda: User.query.get(self.user_id),
+                             lambda: Message.query.count())
+
+        self.assertEqual(user.username, 'user1')
+        self.assertEqual(count, 1)
+
+    def test_gather_raises(self):
+        """A call's exception reaches the caller"""
+
+        with self.assertRaises(NotFound):
+            gather(lambda: User.active_or_404(99999), lambda: 1)
+
+    def test_attach_other_session(self):
+        """Objects loaded in another thread's session work in this one"""
+
+        loaded = []
+
+        def load():
+            with app.app_context():
+                loaded.append(Page(Message.query.all(), None))
+
+        thread = Thread(target=load)
+        thread.start()
+        thread.join()
+
+        page = attach(loaded[0])
+        self.assertIn(page.items[0], db.session)
+        self.assertEqual(page.items[0].user.username, 'user1')
+
+    def test_users_show_through_pool(self):
+        """A profile fetched on the thread pool shows its messages and the viewer's likes"""
+
+        if db.session.get_bind().dialect.name == 'sqlite':
+            self.skipTest("gather() runs sequentially on SQLite")
+
+        viewer = User(username='viewer', email='viewer@example.com', password='password')
+        db.session.add(viewer)
+        db.session.commit()
+        viewer_id = viewer.id
+
+        liked = Message(text='liked warble', user_id=self.user_id)
+        db.session.add(liked)
+        db.session.commit()
+        db.session.add(Likes(user_id=viewer_id, message_id=liked.id))
+        db.session.commit()
+
+        app.config['PARALLEL_QUERIES'] = True
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = viewer_id
+                resp = c.get(f'/users/{self.user_id}')
+        finally:
+            app.config['PARALLEL_QUERIES'] = False
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('@user1', html)
+        self.assertIn('<p>warble', html)
+        self.assertIn('<p>liked warble', html)
+        # Only the liked message shows its heart.
+        self.assertEqual(html.count('class="fas fa-heart like-heart" ></i>'), 1)
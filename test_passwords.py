@@ -0,0 +1,113 @@
+"""Password hashing service tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from threading import BoundedSemaphore
+from unittest import TestCase
+
+from flask import Flask
+
+from models import db, User, Message
+from passwords import PasswordHasher, HashingBusy, hash_password, hash_rounds, passwords
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the hashing pool on its own."""
+
+    def make_hasher(self, **config):
+        flask_app = Flask(__name__)
+        flask_app.config.update(BCRYPT_LOG_ROUNDS=4, **config)
+        return PasswordHasher(flask_app)
+
+    def test_pool_round_trip(self):
+        """Hashes made in the pool check out"""
+
+        hasher = self.make_hasher(BCRYPT_INLINE=False, BCRYPT_WORKERS=1)
+        pw_hash = hasher.hash('secret')
+
+        self.assertEqual(hash_rounds(pw_hash), 4)
+        self.assertTrue(hasher.check(pw_hash, 'secret'))
+        self.assertFalse(hasher.check(pw_hash, 'wrong'))
+        self.assertFalse(hasher.check('not a hash', 'secret'))
+
+    def test_busy(self):
+        """Work beyond BCRYPT_MAX_PENDING is refused"""
+
+        hasher = self.make_hasher(BCRYPT_INLINE=False, BCRYPT_MAX_PENDING=1)
+        hasher.state().pending.acquire()
+
+        with self.assertRaises(HashingBusy):
+            hasher.hash('secret')
+
+        hasher.state().pending.release()
+        self.assertTrue(hasher.check(hasher.hash('secret'), 'secret'))
+
+    def test_needs_rehash(self):
+        """Hashes with another cost need redoing"""
+
+        hasher = self.make_hasher(BCRYPT_INLINE=True)
+
+        self.assertFalse(hasher.needs_rehash(hash_password('secret', 4)))
+        self.assertTrue(hasher.needs_rehash(hash_password('secret', 5)))
+
+
+class LoginHashingTestCase(TestCase):
+    """Test the login view's use of the hasher."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User(username="oldhash", email="old@test.com",
+                    password=hash_password("password", 5))
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_rehash_on_login(self):
+        """Logging in upgrades a hash made with an old cost"""
+
+        resp = self.client.post('/login', data={'username': 'oldhash', 'password': 'password'})
+        self.assertEqual(resp.status_code, 302)
+
+        user = User.query.get(self.user_id)
+        self.assertEqual(hash_rounds(user.password), passwords.state().rounds)
+        self.assertTrue(User.authenticate('oldhash', 'password'))
+
+    def test_busy_login_is_503(self):
+        """A login arriving when the pool is full gets a 503"""
+
+        state = passwords.state()
+        inline, pending = state.inline, state.pending
+        state.inline = False
+        state.pending = BoundedSemaphore(1)
+        state.pending.acquire()
+        try:
+            resp = self.client.post('/login', data={'username': 'oldhash', 'password': 'password'})
+        finally:
+            state.inline, state.pending = inline, pending
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
@@ -0,0 +1,141 @@
+"""Deleted account purge tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_purge.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Likes, Follows, Deletion, Job
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, jobs, session_users
+from purge import tombstone
+from search import message_index
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PurgeTestCase(TestCase):
+    """Test tombstoning and purging deleted users."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        Deletion.query.delete()
+        Job.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        doomed = User.signup(username="doomed", email="doomed@test.com",
+                             password="password", image_url=None)
+        other = User.signup(username="other", email="other@test.com",
+                            password="password", image_url=None)
+        db.session.commit()
+        self.doomed_id = doomed.id
+        self.other_id = other.id
+
+        messages = [Message(text=f"warble {i}", user_id=self.doomed_id) for i in range(3)]
+        theirs = Message(text="still here", user_id=self.other_id)
+        db.session.add_all(messages + [theirs])
+        db.session.commit()
+        self.theirs_id = theirs.id
+
+        db.session.add_all([Likes(user_id=self.other_id, message_id=m.id) for m in messages])
+        db.session.add(Likes(user_id=self.doomed_id, message_id=self.theirs_id))
+        db.session.add_all([
+            Follows(user_being_followed_id=self.doomed_id, user_following_id=self.other_id),
+            Follows(user_being_followed_id=self.other_id, user_following_id=self.doomed_id),
+        ])
+        db.session.commit()
+        User.recount()
+        Message.recount()
+        db.session.commit()
+
+        session_users.invalidate(self.doomed_id, self.other_id)
+        self.batch_size = app.config['PURGE_BATCH_SIZE']
+
+    def tearDown(self):
+        app.config['PURGE_BATCH_SIZE'] = self.batch_size
+        db.session.rollback()
+
+    def test_delete_purges_in_batches(self):
+        """Deleting an account removes everything of theirs and fixes counts"""
+
+        app.config['PURGE_BATCH_SIZE'] = 2
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.doomed_id
+
+            resp = c.post(f'/users/{self.doomed_id}/delete')
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertIsNone(User.query.get(self.doomed_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.doomed_id).count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+
+        other = User.query.get(self.other_id)
+        self.assertEqual((other.likes_count, other.followers_count, other.following_count),
+                         (0, 0, 0))
+        self.assertEqual(Message.query.get(self.theirs_id).like_count, 0)
+
+        deletion = Deletion.query.get(self.doomed_id)
+        self.assertIsNotNone(deletion.finished_at)
+        # 1 like given, 3 messages and their 3 likes, 2 follows, the user.
+        self.assertEqual(deletion.rows_deleted, 10)
+
+    def test_tombstoned_user_is_gone(self):
+        """Until the purge runs, a deleted user can't be seen or log in"""
+
+        tombstone(self.doomed_id)
+        db.session.commit()
+
+        self.assertIsNone(User.authenticate('doomed', 'password'))
+        self.assertIsNone(session_users.load(self.doomed_id))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.other_id
+
+            self.assertEqual(c.get(f'/users/{self.doomed_id}').status_code, 404)
+
+        with app.app_context():
+            self.assertEqual(jobs.run_pending(), 1)
+            self.assertIsNone(User.query.get(self.doomed_id))
+            self.assertEqual(Job.query.one().status, Job.DONE)
+
+    def test_tombstoned_content_is_hidden(self):
+        """Until the purge runs, a deleted user's messages and follows don't show"""
+
+        tombstone(self.doomed_id)
+        db.session.commit()
+        message_index.clear()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.other_id
+
+            for url in ['/', '/users/likes', f'/users/{self.other_id}/following',
+                        f'/users/{self.other_id}/followers', '/messages/search?q=warble']:
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, 200, url)
+                self.assertNotIn(b'<p>warble', resp.data, url)
+                self.assertNotIn(b'@doomed', resp.data, url)
+
+            resp = c.get('/api/v1/timeline')
+            self.assertEqual([m['text'] for m in resp.get_json()['messages']], ['still here'])
+
+        self.assertEqual(Job.query.one().status, Job.QUEUED)
@@ -0,0 +1,136 @@
+"""Login throttling tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message
+from ratelimit import LocalRateLimitBackend
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, login_limiter
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TokenBucketTestCase(TestCase):
+    """Test the in-process buckets."""
+
+    def test_take(self):
+        """A bucket admits its burst, then says how long to wait"""
+
+        backend = LocalRateLimitBackend()
+
+        self.assertEqual(backend.take('k', 1, 2), 0)
+        self.assertEqual(backend.take('k', 1, 2), 0)
+        wait = backend.take('k', 1, 2)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+
+        self.assertEqual(backend.take('other', 1, 2), 0)
+        self.assertLess(backend.tokens('k', 1, 2), 1)
+
+
+class LoginLimiterTestCase(TestCase):
+    """Test throttled logins."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        User.signup(username="testuser1",
+                    email="test1@test.com",
+                    password="testuser1",
+                    image_url=None)
+        db.session.commit()
+
+        self.config = {key: app.config[key] for key in
+                       ('LOGIN_IP_BURST', 'LOGIN_USERNAME_BURST')}
+        login_limiter.backend.clear()
+        login_limiter.unknown.clear()
+
+    def tearDown(self):
+        app.config.update(self.config)
+        login_limiter.backend.clear()
+        login_limiter.unknown.clear()
+        db.session.rollback()
+
+    def log_in(self, username, password):
+        return self.client.post('/login', data={'username': username, 'password': password})
+
+    def test_login_page(self):
+        """The login form renders"""
+
+        resp = self.client.get('/login')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'Welcome back', resp.data)
+
+    def test_ip_limit(self):
+        """One IP can't keep trying"""
+
+        app.config['LOGIN_IP_BURST'] = 2
+
+        self.assertEqual(self.log_in('testuser1', 'wrongpassword').status_code, 302)
+        self.assertEqual(self.log_in('nobody', 'wrongpassword').status_code, 302)
+
+        resp = self.log_in('testuser1', 'testuser1')
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+    def test_username_limit(self):
+        """Failed attempts lock a username, good ones don't"""
+
+        app.config['LOGIN_USERNAME_BURST'] = 2
+
+        self.assertEqual(self.log_in('testuser1', 'testuser1').status_code, 302)
+        self.assertEqual(self.log_in('testuser1', 'testuser1').status_code, 302)
+        self.assertEqual(self.log_in('testuser1', 'wrongpassword').status_code, 302)
+        self.assertEqual(self.log_in('testuser1', 'wrongpassword').status_code, 302)
+
+        self.assertEqual(self.log_in('testuser1', 'testuser1').status_code, 429)
+
+    def test_unknown_username_cached(self):
+        """A username that didn't exist is refused without a lookup"""
+
+        self.log_in('latecomer', 'password')
+        expires = login_limiter.unknown._expires['latecomer']
+
+        # Created behind the limiter's back: still unknown to it.
+        User.signup(username='latecomer', email='late@test.com',
+                    password='password', image_url=None)
+        db.session.commit()
+
+        with self.client as c:
+            self.log_in('latecomer', 'password')
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+            # Refusals don't push back when the entry runs out.
+            self.assertEqual(login_limiter.unknown._expires['latecomer'], expires)
+
+            login_limiter.forget_unknown('latecomer')
+            self.log_in('latecomer', 'password')
+            with c.session_transaction() as sess:
+                self.assertIn(CURR_USER_KEY, sess)
+
+    def test_signup_forgets_unknown(self):
+        """Signing up makes the username loggable straight away"""
+
+        self.log_in('newbie', 'password')
+        self.assertTrue(login_limiter.is_unknown('newbie'))
+
+        self.client.post('/signup', data={'username': 'newbie', 'email': 'new@test.com',
+                                          'password': 'password'})
+        self.assertFalse(login_limiter.is_unknown('newbie'))
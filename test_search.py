@@ -0,0 +1,172 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY
+import search
+from search import search_users, escape_like, search_messages, message_index
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserSearchTestCase(TestCase):
+    """Test user search."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        db.session.add_all([
+            User(username='bobcat', email='b1@example.com', password='password'),
+            User(username='robert', email='b2@example.com', password='password', bio='I like bob'),
+            User(username='alice', email='a@example.com', password='password', location='Bobtown'),
+            User(username='carol_100', email='c@example.com', password='password'),
+            User(username='carol2100', email='c2@example.com', password='password'),
+        ])
+        db.session.commit()
+
+    def test_ranking(self):
+        """Username prefix matches come first, then other matches"""
+
+        results = search_users('bob')
+
+        self.assertEqual([u.username for u in results.items][:1], ['bobcat'])
+        self.assertEqual({u.username for u in results.items},
+                         {'bobcat', 'robert', 'alice'})
+
+    def test_like_wildcards_escaped(self):
+        """Search text is matched literally"""
+
+        self.assertEqual(escape_like('50%_off'), '50\\%\\_off')
+        results = search_users('l_1')
+
+        self.assertEqual([u.username for u in results.items], ['carol_100'])
+
+    def test_pagination(self):
+        """Results are split into pages"""
+
+        first = search_users('', page=1, per_page=2)
+        third = search_users('', page=3, per_page=2)
+
+        self.assertEqual(len(first.items), 2)
+        self.assertTrue(first.has_next)
+        self.assertEqual(len(third.items), 1)
+        self.assertFalse(third.has_next)
+
+    def test_last_page(self):
+        """There's no next page after MAX_PAGE, even with more results"""
+
+        max_page = search.MAX_PAGE
+        search.MAX_PAGE = 2
+        try:
+            last = search_users('', page=2, per_page=1)
+            clamped = search_users('', page=3, per_page=1)
+        finally:
+            search.MAX_PAGE = max_page
+
+        self.assertEqual(len(last.items), 1)
+        self.assertFalse(last.has_next)
+        self.assertEqual(clamped.page, 2)
+        self.assertFalse(clamped.has_next)
+
+    def test_search_view(self):
+        """The /users page searches and links to the next page"""
+
+        response = self.client.get('/users?q=carol')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'@carol_100', response.data)
+        self.assertNotIn(b'@bobcat', response.data)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
+
+
+class MessageSearchTestCase(TestCase):
+    """Test message search (the in-process index, outside PostgreSQL)."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+        message_index.clear()
+
+        self.client = app.test_client()
+
+        user = User(username='user1', email='test1@example.com', password='password1')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        db.session.add_all([
+            Message(text='The early bird gets the worm', user_id=user.id),
+            Message(text='Bird bird bird, bird is the word', user_id=user.id),
+            Message(text='Nothing to see here', user_id=user.id),
+        ])
+        db.session.commit()
+
+    def test_ranked_matches(self):
+        """All words must match; more occurrences rank higher"""
+
+        results = search_messages('bird')
+        self.assertEqual([m.text for m in results.items],
+                         ['Bird bird bird, bird is the word',
+                          'The early bird gets the worm'])
+
+        results = search_messages('early bird')
+        self.assertEqual([m.text for m in results.items], ['The early bird gets the worm'])
+        self.assertEqual(results.items[0].user.username, 'user1')
+
+    def test_index_kept_current(self):
+        """New and deleted messages show up in (or leave) results"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            search_messages('bird')
+
+            c.post('/messages/new', data={'text': 'A new bird appears'})
+            self.assertEqual(len(search_messages('appears').items), 1)
+
+            msg = Message.query.filter_by(text='A new bird appears').one()
+            c.post(f'/messages/{msg.id}/delete')
+            self.assertEqual(len(search_messages('appears').items), 0)
+
+    def test_search_view(self):
+        """The search page lists matching messages"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            response = c.get('/messages/search?q=worm')
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'The early bird gets the worm', response.data)
+            self.assertNotIn(b'Nothing to see here', response.data)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
@@ -0,0 +1,99 @@
+"""Session user loading tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_session_user.py
+
+
+import os
+from unittest import TestCase
+from flask import g
+from models import db, User, Message
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, session_users
+from cache import LRUCache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class SessionUserTestCase(TestCase):
+    """Test the cached per-request user."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser1",
+                           email="test1@test.com",
+                           password="testuser1",
+                           image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+        session_users.invalidate(self.user_id)
+
+    def test_snapshot_cached(self):
+        """A second load comes from the cache, until invalidated"""
+
+        # The test profile turns caching off (SESSION_USER_TTL = 0).
+        snapshots = app.extensions['session_users']
+        app.extensions['session_users'] = LRUCache(10, ttl=60)
+        try:
+            first = session_users.load(self.user_id)
+            User.query.filter_by(id=self.user_id).update({'username': 'renamed'})
+            db.session.commit()
+
+            self.assertEqual(session_users.load(self.user_id).username, 'testuser1')
+
+            session_users.invalidate(self.user_id)
+            self.assertEqual(session_users.load(self.user_id).username, 'renamed')
+            self.assertEqual(first.id, self.user_id)
+        finally:
+            app.extensions['session_users'] = snapshots
+
+    def test_missing_user(self):
+        """Loading a user that doesn't exist gives None"""
+
+        self.assertIsNone(session_users.load(9999))
+
+    def test_static_skips_lookup(self):
+        """Static files don't load the user"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            c.get('/static/stylesheets/style.css')
+            self.assertIsNone(g.user)
+
+            c.get('/')
+            self.assertEqual(g.user.id, self.user_id)
+
+    def test_profile_edit_invalidates(self):
+        """Editing the profile shows the new username straight away"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.get('/')
+
+            c.post('/users/profile', data={'username': 'newname',
+                                           'email': 'test1@test.com',
+                                           'bio': 'hello',
+                                           'password': 'testuser1'})
+            response = c.get('/')
+
+            self.assertIn(b'@newname', response.data)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
@@ -0,0 +1,245 @@
+"""Timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from models import db, User, Message, Likes, Follows, Job
+
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
+
+
+from app import app, CURR_USER_KEY, timeline_cache
+from timeline import home_timeline, LocalTimelineBackend
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineTestCase(TestCase):
+    """Test the home timeline."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.create_all()
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        Likes.query.delete()
+
+        self.client = app.test_client()
+
+        self.u1 = User(username='user1', email='test1@example.com', password='password1')
+        self.u2 = User(username='user2', email='test2@example.com', password='password2')
+        self.u3 = User(username='user3', email='test3@example.com', password='password3')
+        db.session.add_all([self.u1, self.u2, self.u3])
+        db.session.commit()
+        self.u1_id, self.u2_id = self.u1.id, self.u2.id
+
+        self.u1.following.append(self.u2)
+
+        now = datetime.utcnow()
+        db.session.add_all([
+            Message(text='old from u2', user_id=self.u2.id, timestamp=now - timedelta(days=2)),
+            Message(text='new from u2', user_id=self.u2.id, timestamp=now),
+            Message(text='mine', user_id=self.u1.id, timestamp=now - timedelta(days=1)),
+            Message(text='from a stranger', user_id=self.u3.id, timestamp=now),
+        ])
+        db.session.commit()
+
+    def test_home_timeline(self):
+        """Timeline has followed users' and own messages, newest first"""
+
+        messages = home_timeline(self.u1).items
+
+        self.assertEqual([m.text for m in messages],
+                         ['new from u2', 'mine', 'old from u2'])
+
+    def test_home_timeline_limit(self):
+        """Timeline is capped at the requested size"""
+
+        page = home_timeline(self.u1, limit=2)
+
+        self.assertEqual([m.text for m in page.items], ['new from u2', 'mine'])
+        self.assertIsNotNone(page.next_cursor)
+
+    def test_home_timeline_older_page(self):
+        """The cursor from one page leads to the next"""
+
+        first = home_timeline(self.u1, limit=2)
+        second = home_timeline(self.u1, limit=2, before=first.next_cursor)
+
+        self.assertEqual([m.text for m in second.items], ['old from u2'])
+        self.assertIsNone(second.next_cursor)
+
+    def test_timeline_liked_ids(self):
+        """The timeline comes with the ids of the messages its owner liked"""
+
+        liked = Message.query.filter_by(text='old from u2').one()
+        db.session.add(Likes(user_id=self.u1_id, message_id=liked.id))
+        db.session.commit()
+
+        with app.app_context():
+            # Twice: cold, then (with fan-out on) from the cache.
+            for _ in range(2):
+                page = timeline_cache.timeline(User.query.get(self.u1_id))
+                self.assertEqual(len(page.items), 3)
+                self.assertEqual(page.liked_ids, {liked.id})
+
+    def test_homepage_shows_timeline(self):
+        """Logged in homepage renders the timeline"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            response = c.get('/')
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'new from u2', response.data)
+            self.assertIn(b'mine', response.data)
+            self.assertNotIn(b'from a stranger', response.data)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+        db.session.rollback()
+        db.drop_all()
+
+
+class SharedBackend(LocalTimelineBackend):
+    """Stands in for a store every process shares."""
+
+    shared = True
+
+
+class TimelineFanoutTestCase(TimelineTestCase):
+    """Test the fan-out-on-write timeline cache."""
+
+    def setUp(self):
+        super().setUp()
+        app.config['TIMELINE_FANOUT'] = True
+        timeline_cache.backend.invalidate(self.u1_id)
+
+    def test_new_message_pushed_to_followers(self):
+        """A new message lands at the top of a warm follower timeline"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            c.get('/')
+            self.assertIsNotNone(timeline_cache.backend.get(self.u1_id))
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+            c.post('/messages/new', data={'text': 'fanned out'})
+
+            msg = Message.query.filter_by(text='fanned out').one()
+            self.assertEqual(timeline_cache.backend.get(self.u1_id)[0], msg.id)
+            # An in-process backend is fanned out by the view itself.
+            self.assertEqual(Job.query.filter_by(task='fan_out_message').count(), 0)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            response = c.get('/')
+            self.assertIn(b'fanned out', response.data)
+
+    def test_shared_backend_fan_out_queued(self):
+        """With a shared backend, fan-out is left to a job"""
+
+        local = app.extensions['timeline_cache']
+        app.extensions['timeline_cache'] = SharedBackend()
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+                c.get('/')
+
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u2_id
+                c.post('/messages/new', data={'text': 'fanned out'})
+
+                msg = Message.query.filter_by(text='fanned out').one()
+                self.assertEqual(timeline_cache.backend.get(self.u1_id)[0], msg.id)
+                self.assertEqual(Job.query.filter_by(task='fan_out_message').one().status,
+                                 Job.DONE)
+        finally:
+            app.extensions['timeline_cache'] = local
+
+    def test_deleted_message_removed(self):
+        """Deleting a message takes it out of cached timelines"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            c.get('/')
+
+            mine = Message.query.filter_by(text='mine').one()
+            mine_id = mine.id
+            c.post(f'/messages/{mine_id}/delete')
+
+            self.assertNotIn(mine_id, timeline_cache.backend.get(self.u1_id))
+
+    def test_unfollow_invalidates(self):
+        """Unfollowing drops the cached timeline"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            c.get('/')
+
+            c.post(f'/users/stop-following/{self.u2_id}')
+
+            self.assertIsNone(timeline_cache.backend.get(self.u1_id))
+            response = c.get('/')
+            self.assertNotIn(b'from u2', response.data)
+
+    def test_backend_bounded(self):
+        """Each timeline keeps at most `size` ids"""
+
+        backend = LocalTimelineBackend(max_timelines=2, size=3)
+        backend.set(1, [3, 2, 1])
+        backend.push([1], 4)
+        self.assertEqual(backend.get(1), (4, 3, 2))
+
+        backend.set(2, [])
+        backend.set(3, [])
+        self.assertIsNone(backend.get(1))
+
+    def test_hot_author_not_fanned_out(self):
+        """Authors with too many followers only push to their own timeline"""
+
+        app.config['TIMELINE_FANOUT_MAX_FOLLOWERS'] = 0
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+                c.get('/')
+                cached = timeline_cache.backend.get(self.u1_id)
+
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u2_id
+                c.get('/')
+                c.post('/messages/new', data={'text': 'not fanned out'})
+
+                msg = Message.query.filter_by(text='not fanned out').one()
+                self.assertEqual(timeline_cache.backend.get(self.u1_id), cached)
+                self.assertEqual(timeline_cache.backend.get(self.u2_id)[0], msg.id)
+        finally:
+            app.config['TIMELINE_FANOUT_MAX_FOLLOWERS'] = 10000
+
+    def test_backend_ttl(self):
+        """Timelines expire, and a push doesn't bring one back"""
+
+        backend = LocalTimelineBackend(ttl=0)
+        backend.set(1, [1])
+        self.assertIsNone(backend.get(1))
+
+        backend.push([1], 2)
+        self.assertIsNone(backend.get(1))
+
+    def tearDown(self):
+        app.config['TIMELINE_FANOUT'] = False
+        super().tearDown()
@@ -16,6 +16,7 @@ from models import db, User, Message, Follows
 # connected to the database
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
 
 
 # Now we can import app
@@ -108,6 +109,30 @@ class UserModelTestCase(TestCase):
             self.assertIn(user2,following_of_user1)
             
     
+    def test_follow_checks(self):
+        """Tests is_following / is_followed_by, including after an unfollow"""
+        with self.client:
+            user1 = User(username = 'user1', email = 'test1@example.com', password = 'password1')
+            user2 = User(username = 'user2', email = 'test2@example.com', password = 'password2')
+            user3 = User(username = 'user3', email = 'test3@example.com', password = 'password3')
+            db.session.add_all([user1,user2,user3])
+            db.session.commit()
+
+            db.session.add(Follows(user_being_followed_id=user2.id, user_following_id=user1.id))
+            db.session.commit()
+
+            self.assertTrue(user1.is_following(user2))
+            self.assertFalse(user1.is_following(user3))
+            self.assertTrue(user2.is_followed_by(user1))
+            self.assertFalse(user1.is_followed_by(user2))
+            self.assertTrue(Follows.exists(user1.id, user2.id))
+            self.assertFalse(Follows.exists(user2.id, user1.id))
+
+            Follows.query.delete()
+            db.session.commit()
+            self.assertFalse(user1.is_following(user2))
+            
+            
     def test_successful_authenticate(self):
         """Tests if the authentication works properly"""
         with self.client:
@@ -146,6 +171,30 @@ class UserModelTestCase(TestCase):
             
             
             
+    def test_recount(self):
+        """Tests if recount rebuilds counters from the related tables"""
+        with self.client:
+            user1 = User(username = 'user1', email = 'test1@example.com', password = 'password1')
+            user2 = User(username = 'user2', email = 'test2@example.com', password = 'password2')
+            db.session.add_all([user1,user2])
+            db.session.commit()
+
+            user1.following.append(user2)
+            db.session.add(Message(text='Hello', user_id=user1.id))
+            db.session.commit()
+            self.assertEqual(user1.following_count, 0)
+
+            User.recount()
+            db.session.commit()
+
+            self.assertEqual(user1.messages_count, 1)
+            self.assertEqual(user1.following_count, 1)
+            self.assertEqual(user1.followers_count, 0)
+            self.assertEqual(user2.followers_count, 1)
+            self.assertEqual(user2.messages_count, 0)
+            
+            
+            
     def tearDown(self):
         """Clean up any fouled transaction."""
         db.session.rollback()
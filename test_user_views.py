@@ -5,6 +5,7 @@ from models import db, Message, User
 
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+os.environ['WARBLER_ENV'] = 'test'
 
 from app import app, CURR_USER_KEY
 
@@ -89,6 +90,25 @@ class UserViewTestCase(TestCase):
             
             
 
+    def test_follow_updates_counters(self):
+        """Tests if following and unfollowing keep both users' counters in step"""
+        user1_id, user2_id = self.testuser1.id, self.testuser2.id
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user1_id
+
+            c.post(f"/users/follow/{user2_id}")
+
+            self.assertEqual(User.query.get(user1_id).following_count, 1)
+            self.assertEqual(User.query.get(user2_id).followers_count, 1)
+
+            c.post(f"/users/stop-following/{user2_id}")
+
+            self.assertEqual(User.query.get(user1_id).following_count, 0)
+            self.assertEqual(User.query.get(user2_id).followers_count, 0)
+            
+            
+
     def tearDown(self):
         """Clean up any fouled transaction"""
         db.session.rollback()
@@ -0,0 +1,253 @@
+"""Home timeline queries and fan-out cache for Warbler."""
+
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy import or_
+
+from appstate import AppExtension
+from cache import LRUCache
+from models import db, Follows, Likes, Message
+from pagination import Page, encode_cursor, paginate
+from parallel import gather
+
+TIMELINE_SIZE = 100
+
+
+def followed_ids_query(user_id):
+    """Subquery of ids of the users that `user_id` follows."""
+
+    return (db.session
+            .query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id))
+
+
+def home_timeline(user, limit=TIMELINE_SIZE, before=None):
+    """Page of the newest messages written by `user` or anyone they follow.
+
+    This is a single query: the database does the filtering, ordering and
+    limiting (using the (user_id, timestamp) index on messages), and each
+    message's author is joined in so the template doesn't lazy-load them,
+    as is whether `user` liked it (`Page.liked_ids`). `before` is a
+    cursor from a previous page.
+    """
+
+    query = (Message
+             .with_authors()
+             .filter(or_(Message.user_id.in_(followed_ids_query(user.id)),
+                         Message.user_id == user.id)))
+
+    return paginate(query, before, limit, liked_by=user.id)
+
+
+def followers_ids(user_id, limit=None):
+    """Ids of the users following `user_id` (at most `limit` of them)."""
+
+    return [follower_id for (follower_id,) in (db.session
+                                               .query(Follows.user_following_id)
+                                               .filter(Follows.user_being_followed_id == user_id)
+                                               .limit(limit))]
+
+
+class LocalTimelineBackend:
+    """In-process timeline store: newest-first message ids per user.
+
+    Only timelines that have been read recently are kept (an LRU of at most
+    `max_timelines` users), and each holds at most `size` ids. With `ttl`,
+    a timeline is rebuilt that many seconds after it was read from the
+    database, however many messages were pushed onto it since: pushes only
+    reach this process's timelines, so that's how long one can miss a
+    message posted through another process.
+
+    This is the stand-in for a shared store; anything with the same
+    methods can be passed to `TimelineCache` instead, with `shared` set
+    if every process sees the same timelines through it.
+    """
+
+    shared = False
+
+    def __init__(self, max_timelines=10000, size=TIMELINE_SIZE, ttl=None):
+        self.size = size
+        self._timelines = LRUCache(max_timelines, ttl=ttl)
+        self._lock = Lock()
+
+    def get(self, user_id):
+        """Cached ids for `user_id`, or None if that timeline is cold."""
+
+        return self._timelines.get(user_id)
+
+    def set(self, user_id, ids):
+        """Store the (newest-first) timeline for `user_id`."""
+
+        self._timelines.set(user_id, tuple(ids[:self.size]))
+
+    def push(self, user_ids, message_id):
+        """Put a brand new message at the top of each warm timeline.
+
+        Cold timelines are left alone; they'll be built from the database
+        (and so include this message) the next time they're read. Pushing
+        the same message twice leaves it there once.
+        """
+
+        with self._lock:
+            for user_id in user_ids:
+                ids = self._timelines.get(user_id)
+                if ids is not None and message_id not in ids:
+                    self._timelines.replace(user_id, ((message_id,) + ids)[:self.size])
+
+    def remove(self, user_ids, message_id):
+        """Take a message out of each timeline that has it.
+
+        A full timeline is dropped instead, since the message just past its
+        end now belongs on it and only the database knows which that is.
+        """
+
+        with self._lock:
+            for user_id in user_ids:
+                ids = self._timelines.get(user_id)
+                if ids is None or message_id not in ids:
+                    continue
+                if len(ids) >= self.size:
+                    self._timelines.pop(user_id)
+                else:
+                    self._timelines.replace(user_id, tuple(id for id in ids if id != message_id))
+
+    def invalidate(self, user_id):
+        """Forget the timeline for `user_id`."""
+
+        self._timelines.pop(user_id)
+
+
+class TimelineCache(AppExtension):
+    """Fan-out-on-write home timelines.
+
+    When the app's TIMELINE_FANOUT setting is on, new messages are pushed
+    onto their followers' cached timelines as they're written, so reading
+    the home page is a lookup of at most one page of ids plus one
+    primary-key query. A cold timeline falls back to `home_timeline()`
+    and is cached from there. With the setting off every method is a
+    no-op and `timeline()` is just `home_timeline()`.
+
+    The default backend lives in each process, so with several workers a
+    cached timeline can miss messages posted through the others for up to
+    TIMELINE_CACHE_TTL seconds. Views fan out right after their commit, in
+    the process serving the post; only with a shared backend (`queued`)
+    is that left to a background job. Authors with more than
+    TIMELINE_FANOUT_MAX_FOLLOWERS followers aren't fanned out at all, so
+    posting never walks a huge follower list; their followers see new
+    messages once their cached timelines expire.
+    """
+
+    name = 'timeline_cache'
+
+    def __init__(self, app=None, backend=None):
+        super().__init__()
+        # Shared by every app, if given; otherwise each gets a local one.
+        self._backend = backend
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TIMELINE_FANOUT', False)
+        app.config.setdefault('TIMELINE_CACHE_USERS', 10000)
+        app.config.setdefault('TIMELINE_CACHE_TTL', 60)
+        app.config.setdefault('TIMELINE_FANOUT_MAX_FOLLOWERS', 10000)
+
+        self.bind(app, self._backend or LocalTimelineBackend(
+            max_timelines=app.config['TIMELINE_CACHE_USERS'],
+            ttl=app.config['TIMELINE_CACHE_TTL']))
+
+    @property
+    def backend(self):
+        return self.state()
+
+    @property
+    def enabled(self):
+        return current_app.config['TIMELINE_FANOUT']
+
+    @property
+    def queued(self):
+        """Whether fan-out can wait for a background job: only with a
+        shared backend do a job's pushes reach every process's timelines."""
+
+        return self.enabled and self.backend.shared
+
+    def timeline(self, user, before=None):
+        """A page of `user`'s home timeline, with their `liked_ids`.
+
+        Only the first page is cached; older pages (`before` set) always
+        come from the database.
+        """
+
+        size = self.backend.size
+
+        if not self.enabled or before:
+            return home_timeline(user, size, before)
+
+        ids = self.backend.get(user.id)
+        if ids is None:
+            page = home_timeline(user, size)
+            self.backend.set(user.id, [m.id for m in page.items])
+            return page
+
+        # Both lookups only need the ids, so they can go out together.
+        ids = list(ids)
+        user_id = user.id
+        messages, liked_ids = gather(lambda: Message.get_many(ids),
+                                     lambda: Likes.liked_ids(user_id, ids))
+        # A full cached timeline is a window onto a longer one.
+        if len(ids) >= size and messages:
+            return Page(messages, encode_cursor(messages[-1]), liked_ids)
+        return Page(messages, None, liked_ids)
+
+    def audience(self, author_id):
+        """Whose timelines a message by `author_id` goes on: the author's,
+        and their followers' unless they have too many to walk."""
+
+        limit = current_app.config['TIMELINE_FANOUT_MAX_FOLLOWERS']
+        user_ids = followers_ids(author_id, limit + 1)
+        if len(user_ids) > limit:
+            user_ids = []
+        return user_ids + [author_id]
+
+    def add_message(self, message):
+        """Put a newly written message on its author's own timeline."""
+
+        if self.enabled:
+            self.backend.push([message.user_id], message.id)
+
+    def fan_out(self, message_id, author_id):
+        """Push a newly written message to its author and their followers.
+
+        This walks the follower list (at most
+        TIMELINE_FANOUT_MAX_FOLLOWERS of it). When `queued`, views leave
+        it to a background job (see actions.py) and only call
+        `add_message()` themselves.
+        """
+
+        if self.enabled:
+            self.backend.push(self.audience(author_id), message_id)
+
+    def drop_message(self, message_id, author_id):
+        """Take a deleted message off its author's own timeline."""
+
+        if self.enabled:
+            self.backend.remove([author_id], message_id)
+
+    def remove_message(self, message_id, author_id):
+        """Drop a deleted message from the timelines it was pushed to.
+
+        Others skip it anyway, as its id no longer finds a message. Like
+        `fan_out()`, it's left to a background job when `queued`, with
+        `drop_message()` called inline.
+        """
+
+        if self.enabled:
+            self.backend.remove(self.audience(author_id), message_id)
+
+    def invalidate(self, user_id):
+        """Forget `user_id`'s timeline, e.g. after they (un)follow someone."""
+
+        if self.enabled:
+            self.backend.invalidate(user_id)